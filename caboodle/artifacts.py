@@ -1,6 +1,6 @@
 from google.cloud import storage
 from typing import List, Tuple, Union
-from caboodle import gcs
+from caboodle import gcs, columnar
 import pickle
 import abc
 import io
@@ -11,11 +11,17 @@ try:
     fireworks_installed = True
 except ModuleNotFoundError:
     fireworks_installed = False
+try:
+    import numpy as np
+    numpy_installed = True
+except ModuleNotFoundError:
+    numpy_installed = False
 
 PathOrBuffer = Union[str, Type[io.BufferedIOBase]]
 file_codes = {
         'read': 'rb',
         'write': 'wb',
+        'update': 'r+b',
     }
 
 class get_buffer():
@@ -31,7 +37,7 @@ class get_buffer():
         self.path_or_buffer = path_or_buffer
         if type(path_or_buffer) is str: # Is a path
             self.type = 'string'
-        elif isinstance(path_or_buffer, io.BufferedIOBase):
+        elif isinstance(path_or_buffer, (io.BufferedIOBase, io.RawIOBase)):
             self.type = 'buffer'
         else:
             raise TypeError("Argument {0} with type {1} is not a string or bytes buffer.")
@@ -57,6 +63,8 @@ class Artifact(metaclass=abc.ABCMeta):
     content, which is the actual data to be stored. The key is used to refer to the artifact in the storage system.
     """
     artifact_type = object
+    __slots__ = ('key', '_content', 'path_or_buffer') # Avoids a per-instance __dict__ for large collections.
+
     def __init__(self, key:str, content:artifact_type = None, deserialize=False, path_or_buffer=None):
         self.key = key
         self._content = content
@@ -104,7 +112,7 @@ class Artifact(metaclass=abc.ABCMeta):
         """
         This will deserialize data from file if necessary.
         """
-        if self._content:
+        if self._content is not None:
             return self._content
 
         elif self.path_or_buffer is not None:
@@ -131,6 +139,7 @@ if fireworks_installed:
         Represents a Fireworks Message as an artifact.
         """
         artifact_type = fireworks.Message
+        __slots__ = ()
 
         def serialize(self, path_or_buffer:PathOrBuffer):
             with get_buffer(path_or_buffer, direction = 'write') as f:
@@ -140,11 +149,96 @@ if fireworks_installed:
             with get_buffer(path_or_buffer, direction = 'read') as f:
                 return fireworks.Message.load(f)
 
+    class ChunkedFireworksArtifact(FireworksArtifact):
+        """
+        Represents a Fireworks Message stored in the chunked, column-oriented format of
+        caboodle.columnar, with rows_per_chunk rows per chunk. Use read to load a subset of
+        the columns and rows without reading the rest of the message, and append to add
+        rows to an existing artifact without rewriting it.
+        """
+        __slots__ = ()
+        rows_per_chunk = 65536
+
+        def serialize(self, path_or_buffer:PathOrBuffer):
+            with get_buffer(path_or_buffer, direction = 'write') as f:
+                f.truncate()
+                table = columnar.ColumnarFile(f)
+                for columns in self.chunk_columns(self.data):
+                    table.append(columns)
+                table.write_index()
+
+        def deserialize(self, path_or_buffer:PathOrBuffer):
+            return self.read(path_or_buffer=path_or_buffer)
+
+        def read(self, columns: List[str] = None, rows: slice = None, path_or_buffer:PathOrBuffer = None) -> 'fireworks.Message':
+            """
+            Reads the given columns (or all of them) in the given contiguous slice of rows (or
+            all of them) from path_or_buffer, which defaults to the artifact's own. For
+            artifacts opened with GCSCoffer.open(key, buffer_size=0), only the segments
+            holding the selected data are fetched.
+            """
+            path_or_buffer = self.path_or_buffer if path_or_buffer is None else path_or_buffer
+            with get_buffer(path_or_buffer, direction = 'read') as f:
+                return fireworks.Message(columnar.ColumnarFile(f).read(columns=columns, rows=rows))
+
+        def append(self, message: 'fireworks.Message'):
+            """
+            Appends the rows of message to the artifact stored at path_or_buffer, which must
+            be a local path or a writable buffer. Existing chunks are not rewritten.
+            """
+            if type(self.path_or_buffer) is str and not os.path.exists(self.path_or_buffer):
+                open(self.path_or_buffer, 'wb').close()
+            with get_buffer(self.path_or_buffer, direction = 'update') as f:
+                table = columnar.ColumnarFile(f)
+                for columns in self.chunk_columns(message):
+                    table.append(columns)
+                table.write_index()
+            self._content = None # Reloaded from path_or_buffer on next access.
+
+        def chunk_columns(self, message: 'fireworks.Message'):
+            """
+            Yields the columns of each chunk of rows_per_chunk rows of message.
+            """
+            for start in range(0, len(message), self.rows_per_chunk):
+                chunk = message[start:min(start + self.rows_per_chunk, len(message))] # Messages do not clamp slices.
+                yield {column: chunk[column] for column in chunk.columns}
+
+if numpy_installed:
+
+    class NumpyArtifact(Artifact):
+        """
+        Represents a NumPy array stored in the .npy format as an artifact.
+        """
+        artifact_type = np.ndarray
+        __slots__ = ()
+
+        def serialize(self, path_or_buffer:PathOrBuffer):
+            with get_buffer(path_or_buffer, direction = 'write') as f:
+                np.save(f, self.data, allow_pickle=False)
+
+        def deserialize(self, path_or_buffer:PathOrBuffer):
+            with get_buffer(path_or_buffer, direction = 'read') as f:
+                return np.load(f, allow_pickle=False)
+
+        @staticmethod
+        def read_header(f) -> Tuple[tuple, bool, 'np.dtype']:
+            """
+            Reads the header of a .npy file from the current position of f, leaving f at
+            the start of the array data. Returns the shape, fortran_order and dtype.
+            """
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                return np.lib.format.read_array_header_1_0(f)
+            elif version == (2, 0):
+                return np.lib.format.read_array_header_2_0(f)
+            raise ValueError("Unsupported .npy format version {0}".format(version))
+
 class PickleArtifact(Artifact):
     """
     Represens a Pickled object as an artifact.
     """
     artifact_type = object
+    __slots__ = ()
     def serialize(self, path_or_buffer:PathOrBuffer):
         with get_buffer(path_or_buffer, direction = 'write') as f:
             pickle.dump(self.data, f)
@@ -160,6 +254,7 @@ class BinaryArtifact(Artifact):
     Serializes binary directly to file.
     """
     artifact_type = bytes
+    __slots__ = ()
     def serialize(self, path_or_buffer:PathOrBuffer):
         data = self.data
         if type(data) is io.BytesIO:
@@ -178,4 +273,5 @@ class AvroArtifact(Artifact):
     Serializes an Avro object to file.
     """
     artifact_type = object
+    __slots__ = ()
     pass
@@ -3,6 +3,7 @@ from caboodle import artifacts
 from fireworks import Message
 import pickle
 import torch
+import numpy as np
 import os
 import io
 
@@ -76,6 +77,23 @@ def test_FireworksArtifact():
     m3 = art.deserialize(buffer)
     assert m3 == m
 
+def test_ChunkedFireworksArtifact():
+
+    class SmallChunks(artifacts.ChunkedFireworksArtifact):
+        __slots__ = ()
+        rows_per_chunk = 2
+
+    m = Message({'a': [1,2,3], 'b': torch.tensor([4,5,6])})
+    art = SmallChunks('test.cfireworks', m)
+    buffer = io.BytesIO()
+    art.serialize(buffer)
+    assert art.deserialize(buffer) == m
+    art.path_or_buffer = buffer
+    assert art.read(columns=['b'], rows=slice(1, 3)) == Message({'b': torch.tensor([5,6])})
+    art.append(Message({'a': [7], 'b': torch.tensor([8])}))
+    assert art.read(columns=['a'], rows=slice(3, 4)) == Message({'a': [7]})
+    assert len(art.data) == 4
+
 def test_PickleArtifact():
     p = [1,2,3,4,'hii']
     art = artifacts.PickleArtifact('test', p)
@@ -103,3 +121,19 @@ def test_BinaryArtifact():
     art.serialize(buffer)
     b3 = art.deserialize(buffer)
     assert b3 == b
+
+def test_NumpyArtifact():
+    a = np.arange(12, dtype=np.float32).reshape(3, 4)
+    art = artifacts.NumpyArtifact('test', a)
+    path = os.path.join(base_path, 'numpy')
+    with DummyFile(path):
+        file_path = os.path.join(path,'test.npy')
+        art.serialize(file_path)
+        a2 = art.deserialize(file_path)
+        assert (a2 == a).all()
+    buffer = io.BytesIO()
+    art.serialize(buffer)
+    a3 = art.deserialize(buffer)
+    assert (a3 == a).all()
+    buffer.seek(0)
+    assert artifacts.NumpyArtifact.read_header(buffer) == ((3, 4), False, np.dtype(np.float32))
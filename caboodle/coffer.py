@@ -1,12 +1,18 @@
 from google.cloud import storage
 from typing import List, Tuple, Union
-from caboodle import gcs, artifacts
+from caboodle import gcs, artifacts, concurrency
+from caboodle.containers import BudgetedArtifactList, ArtifactSet
 from caboodle.artifacts import Artifact
 import pickle
 import abc
 import io
 import random
 import os
+import shutil
+import copy
+import heapq
+import json
+from concurrent.futures import ThreadPoolExecutor
 from typing import Union, Type, Dict
 
 try:
@@ -14,6 +20,11 @@ try:
     fireworks_installed = True
 except ModuleNotFoundError:
     fireworks_installed = False
+try:
+    import numpy as np
+    numpy_installed = True
+except ModuleNotFoundError:
+    numpy_installed = False
 
 suffixes = { # File suffixes are used to automatically read in artifacts from file into the correct format.
     'bin': artifacts.BinaryArtifact,
@@ -23,6 +34,10 @@ suffixes = { # File suffixes are used to automatically read in artifacts from fi
 
 if fireworks_installed:
     suffixes['fireworks'] = artifacts.FireworksArtifact
+    suffixes['cfireworks'] = artifacts.ChunkedFireworksArtifact
+
+if numpy_installed:
+    suffixes['npy'] = artifacts.NumpyArtifact
 
 def infer_type(name):
     """
@@ -34,10 +49,26 @@ def infer_type(name):
     else:
         return suffixes[0]
 
+def partition_by_size(manifest: Dict[str, int], count: int) -> List[List[str]]:
+    """
+    Deterministically partitions the keys of a manifest mapping keys to sizes in bytes
+    into count groups with approximately equal total sizes. Keys are assigned greedily,
+    largest first, to the group with the smallest total so far.
+    """
+    groups = [[] for _ in range(count)]
+    heap = [(0, i) for i in range(count)]
+    for key, size in sorted(manifest.items(), key=lambda item: (-item[1], item[0])):
+        total, i = heapq.heappop(heap)
+        groups[i].append(key)
+        heapq.heappush(heap, (total + size, i))
+    return [sorted(group) for group in groups]
+
 class Coffer(metaclass=abc.ABCMeta):
     """
     Represents multiple artifacts stored in a single location (GCS bucket, etc.) by the output of or input to a pipeline step on Argo / Kubeflow.
     """
+    subset = None # If set (see shard), maps the keys of the only artifacts visible through this coffer to their sizes.
+    limiter = None # If set, an AdaptiveLimit which bounds the number of concurrent reads from this coffer.
 
     @abc.abstractmethod
     def upload(self, artifacts: List[Artifact]):
@@ -68,6 +99,116 @@ class Coffer(metaclass=abc.ABCMeta):
         """
         pass
 
+    def open(self, key: str) -> io.BufferedIOBase:
+        """
+        Returns a read-only, seekable binary file object containing the serialized
+        contents of the artifact with the given key. This can be passed directly to
+        Artifact.deserialize.
+        """
+        raise NotImplementedError("{0} does not support opening artifacts as files.".format(type(self).__name__))
+
+    def write(self, key: str, file_obj: io.BufferedIOBase):
+        """
+        Stores the serialized contents of an artifact read from file_obj under the given key.
+        """
+        raise NotImplementedError("{0} does not support writing raw artifacts.".format(type(self).__name__))
+
+    def list_keys(self) -> List[str]:
+        """
+        Returns the keys of all artifacts in the coffer.
+        """
+        raise NotImplementedError("{0} does not support listing artifacts.".format(type(self).__name__))
+
+    def list_artifacts(self) -> ArtifactSet:
+        """
+        Returns a compact ArtifactSet listing the key, size and type of every artifact in
+        the coffer without downloading any of them.
+        """
+        raise NotImplementedError("{0} does not support listing artifacts.".format(type(self).__name__))
+
+    def manifest(self) -> Dict[str, int]:
+        """
+        Returns a dictionary mapping the key of every artifact in the coffer to its size in
+        bytes. This can be saved as JSON and passed to shard so that workers do not each
+        need to list the coffer.
+        """
+        artifact_set = self.list_artifacts()
+        return {artifact_set.key(i): artifact_set.size(i) for i in range(len(artifact_set))}
+
+    def shard(self, index: int, count: int, manifest: Union[Dict[str, int], str] = None) -> 'Coffer':
+        """
+        Returns a view of this coffer containing only the artifacts assigned to shard index
+        out of count. Keys are partitioned deterministically so that each shard holds about
+        the same number of bytes (see partition_by_size), so workers which call shard with
+        the same count and manifest receive disjoint shares covering the whole coffer.
+        The manifest can be a dictionary as returned by the manifest method or the path to
+        a JSON file containing one; if it is not provided, the coffer is listed.
+        """
+        if not 0 <= index < count:
+            raise ValueError("Shard index {0} is out of range for {1} shards.".format(index, count))
+        if manifest is None:
+            manifest = self.manifest()
+        elif type(manifest) is str:
+            with open(manifest) as f:
+                manifest = json.load(f)
+        view = copy.copy(self)
+        view.subset = {key: manifest[key] for key in partition_by_size(manifest, count)[index]}
+        return view
+
+    def copy_to(self, other: 'Coffer', keys: List[str] = None):
+        """
+        Copies artifacts from this coffer into another one. If keys is not provided, all
+        artifacts are copied. Artifacts are streamed as raw bytes and are never deserialized.
+        """
+        if keys is None:
+            keys = self.list_keys()
+        for key in keys:
+            with self.open(key) as f:
+                other.write(key, f)
+
+    def load_stacked(self, keys: List[str], max_workers: int = 8) -> 'np.ndarray':
+        """
+        Loads .npy artifacts which all have the same shape and dtype into a single array
+        whose first axis indexes the artifacts, equivalent to np.stack on their contents.
+        The output is allocated once from the header of the first artifact, and up to
+        max_workers workers read each artifact's data directly into its slice, subject to
+        the coffer's limiter.
+        """
+        if not numpy_installed:
+            raise ModuleNotFoundError("load_stacked requires numpy to be installed.")
+        keys = list(keys)
+        if not keys:
+            raise ValueError("At least one key is required.")
+        with self.open(keys[0]) as f:
+            shape, _, dtype = artifacts.NumpyArtifact.read_header(f)
+        if dtype.hasobject:
+            raise ValueError("Cannot stack arrays with object dtype {0}".format(dtype))
+        stacked = np.empty((len(keys),) + shape, dtype=dtype)
+        rows = stacked.reshape(len(keys), -1)
+
+        def read_into(index):
+            key = keys[index]
+            with concurrency.limited(self.limiter, size=rows[index].nbytes), self.open(key) as f:
+                header = artifacts.NumpyArtifact.read_header(f)
+                if header != (shape, False, dtype):
+                    raise ValueError(
+                        "Artifact {0} has header {1}, expected C-ordered arrays with shape {2} and dtype {3}".format(
+                            key, header, shape, dtype,
+                        )
+                    )
+                view = memoryview(rows[index]).cast('B')
+                filled = 0
+                while filled < len(view):
+                    n = f.readinto(view[filled:])
+                    if not n:
+                        raise ValueError("Artifact {0} ended before all of its data was read.".format(key))
+                    filled += n
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for _ in executor.map(read_into, range(len(keys))):
+                pass
+        return stacked
+
     def upload_folder(self, path):
         """
         Uploads all files in a folder to the coffer storage.
@@ -126,10 +267,38 @@ class DebugCoffer(Coffer):
         self.artifacts.extend(artifacts)
 
     def download(self) -> List[Type[Artifact]]:
+        if self.subset is not None:
+            return [artifact for artifact in self.artifacts if artifact.key in self.subset]
         return self.artifacts
     
     def delete(self):
-        self.artifacts = []
+        if self.subset is not None:
+            self.artifacts[:] = [artifact for artifact in self.artifacts if artifact.key not in self.subset]
+        else:
+            self.artifacts.clear()
+
+    def open(self, key: str) -> io.BufferedIOBase:
+        for artifact in self.artifacts:
+            if artifact.key == key:
+                buffer = io.BytesIO()
+                artifact.serialize(buffer)
+                buffer.seek(0)
+                return buffer
+        raise ValueError("Could not find artifact {0} in {1}".format(key, self.location))
+
+    def write(self, key: str, file_obj: io.BufferedIOBase):
+        artifact_type = infer_type(key)
+        buffer = io.BytesIO(file_obj.read())
+        self.artifacts.append(artifact_type(key, path_or_buffer=buffer, deserialize=True))
+
+    def list_keys(self) -> List[str]:
+        return [artifact.key for artifact in self.download()]
+
+    def list_artifacts(self) -> ArtifactSet:
+        artifact_set = ArtifactSet(coffer=self)
+        for key, buffer in self.serialize_artifacts(self.download()):
+            artifact_set.append(key, buffer.getbuffer().nbytes, infer_type(key))
+        return artifact_set
 
 class LocalCoffer(Coffer):
     """
@@ -147,29 +316,76 @@ class LocalCoffer(Coffer):
         for artifact in artifacts:
             artifact.serialize(os.path.join(self.folder, artifact.key))
         
-    def download(self) -> List[Type[Artifact]]:
+    def download(self, memory_budget: int = None) -> List[Type[Artifact]]:
+        """
+        Returns the artifacts in the coffer. If memory_budget is set, a BudgetedArtifactList
+        is returned instead, which deserializes artifacts lazily on access and keeps at most
+        memory_budget bytes of them loaded at once.
+        """
+        if memory_budget is not None:
+            self.artifacts = BudgetedArtifactList(memory_budget)
+            for filename in self._filenames():
+                artifact_type = infer_type(filename)
+                self.artifacts.append(artifact_type(filename, path_or_buffer=os.path.join(self.folder, filename)))
+            return self.artifacts
 
         self.artifacts = []
-        for filename in os.listdir(self.folder):
+        for filename in self._filenames():
             try:
                 artifact_type = infer_type(filename)
                 key = filename
-                artifact = artifact_type(key, os.path.join(self.folder, key), deserialize=True)
+                artifact = artifact_type(key, path_or_buffer=os.path.join(self.folder, key), deserialize=True)
                 self.artifacts.append(artifact)
             except:
                 pass
         return self.artifacts
 
+    def delete(self):
+        """
+        Deletes all artifacts in the Coffer.
+        """
+        for filename in self._filenames():
+            os.remove(os.path.join(self.folder, filename))
+
+    def open(self, key: str) -> io.BufferedIOBase:
+        return open(os.path.join(self.folder, key), 'rb')
+
+    def write(self, key: str, file_obj: io.BufferedIOBase):
+        with open(os.path.join(self.folder, key), 'wb') as f:
+            shutil.copyfileobj(file_obj, f)
+
+    def list_keys(self) -> List[str]:
+        return self._filenames()
+
+    def list_artifacts(self) -> ArtifactSet:
+        artifact_set = ArtifactSet(coffer=self)
+        if self.subset is not None:
+            for key in sorted(self.subset):
+                artifact_set.append(key, self.subset[key], infer_type(key))
+            return artifact_set
+        for entry in os.scandir(self.folder):
+            artifact_set.append(entry.name, entry.stat().st_size, infer_type(entry.name))
+        return artifact_set
+
+    def _filenames(self) -> List[str]:
+        """
+        Returns the names of the files for the artifacts visible through this coffer.
+        """
+        if self.subset is not None:
+            return sorted(self.subset)
+        return os.listdir(self.folder)
+
 class GCSCoffer(Coffer):
     """
     Represents multiple artifacts stored in a folder in a GCS bucket.
     """
-    def __init__(self, gcs_path, storage_client=None):
+    def __init__(self, gcs_path, storage_client=None, limiter: concurrency.AdaptiveLimit = None):
 
         bucket_name, path = gcs.parse_gcs_path(gcs_path)
         self.bucket_name = bucket_name
         self.path = path
         self.storage_client = storage_client or gcs.get_storage_client()
+        self.limiter = limiter or concurrency.AdaptiveLimit()
 
     @property
     def location(self) -> str:
@@ -181,37 +397,59 @@ class GCSCoffer(Coffer):
         serialized_artifacts = self.serialize_artifacts(artifacts)
         for key, buffer in serialized_artifacts:
             blob = bucket.blob(os.path.join(self.path, key))
-            blob.upload_from_string(buffer.read())
+            data = buffer.read()
+            self.limiter.call(blob.upload_from_string, data, size=len(data))
+            if gcs.crc32c_installed:
+                gcs.verify_upload(blob, gcs.encode_crc32c(gcs.crc32c(data)), key, self.limiter)
 
     def __iter__(self):
 
-        bucket = self.storage_client.get_bucket(self.bucket_name)
-        blobs = bucket.list_blobs(prefix=self.path)
+        blobs = self._blobs()
         def generator():
             for blob in blobs:
                 try:
                     artifact_type = infer_type(blob.name)
-                    buffer = io.BytesIO(blob.download_as_string())
+                    buffer = io.BytesIO(self.limiter.call(blob.download_as_string, size=blob.size or 0))
                     key = blob.name.split('/')[-1]
                     artifact = artifact_type(key, buffer, deserialize=True)
                     yield artifact
                 except KeyError:
                     pass
+        return generator()
 
-
-    def download(self, local_path = None) -> List[Artifact]:
-        bucket = self.storage_client.get_bucket(self.bucket_name)
-        blobs = bucket.list_blobs(prefix=self.path)
-        artifacts = []
+    def download(self, local_path = None, memory_budget: int = None, spill_dir: str = None) -> List[Artifact]:
+        """
+        Downloads the artifacts in the coffer, saving them under local_path if provided.
+        If memory_budget is set, each object is downloaded straight to disk (under
+        local_path, or a temporary folder in spill_dir) and a BudgetedArtifactList is
+        returned, which deserializes artifacts lazily on access and keeps at most
+        memory_budget bytes of them loaded at once.
+        """
+        blobs = self._blobs()
+        if memory_budget is None:
+            artifacts = []
+        else:
+            artifacts = BudgetedArtifactList(memory_budget, spill_dir=spill_dir)
         for blob in blobs:
             try:
                 artifact_type = infer_type(blob.name)
-                buffer = io.BytesIO(blob.download_as_string())
                 key = blob.name.split('/')[-1]
-                artifact = artifact_type(key, buffer, path_or_buffer=os.path.join(local_path, key), deserialize=True)
-                if local_path:
-                    artifact.save()
-                    artifact.close()
+                if memory_budget is None:
+                    buffer = io.BytesIO(self.limiter.call(blob.download_as_string, size=blob.size or 0))
+                    artifact = artifact_type(key, path_or_buffer=buffer, deserialize=True)
+                    if local_path:
+                        artifact.path_or_buffer = os.path.join(local_path, key)
+                        artifact.save()
+                        artifact.close()
+                else:
+                    path = os.path.join(local_path, key) if local_path else artifacts.spill_path(key)
+                    try:
+                        self.limiter.call(blob.download_to_filename, path, size=blob.size or 0)
+                    except Exception:
+                        if os.path.exists(path): # Do not leave a partial file behind.
+                            os.remove(path)
+                        raise
+                    artifact = artifact_type(key, path_or_buffer=path)
                 artifacts.append(artifact)
             except KeyError:
                 pass
@@ -239,11 +477,89 @@ class GCSCoffer(Coffer):
 
         return artifact
 
+    def open(self, key: str, buffer_size: int = gcs.DEFAULT_READ_AHEAD) -> io.BufferedIOBase:
+        """
+        Opens an artifact as a read-only, seekable file object backed by ranged reads,
+        fetching buffer_size bytes at a time (or exactly the bytes requested by each read,
+        if buffer_size is 0). Unlike get, the object is never loaded into memory all at once.
+        """
+        return gcs.open_file(
+            self.bucket_name,
+            os.path.join(self.path, key),
+            buffer_size=buffer_size,
+            storage_client=self.storage_client,
+        )
+
+    def appendable(self, key: str, compact_every: int = 16) -> gcs.AppendableBlob:
+        """
+        Returns an AppendableBlob for the artifact with the given key, which can be used to
+        write results incrementally. The committed contents can be read with open or get.
+        """
+        return gcs.AppendableBlob(
+            self.bucket_name,
+            os.path.join(self.path, key),
+            compact_every=compact_every,
+            storage_client=self.storage_client,
+        )
+
+    def write(self, key: str, file_obj: io.BufferedIOBase):
+        bucket = self.storage_client.get_bucket(self.bucket_name)
+        blob = bucket.blob(os.path.join(self.path, key))
+        reader = gcs.Crc32cReader(file_obj) if gcs.crc32c_installed else file_obj
+        with self.limiter.slot(): # A stream cannot be rewound to retry the upload.
+            blob.upload_from_file(reader)
+        if gcs.crc32c_installed:
+            gcs.verify_upload(blob, reader.checksum, key, self.limiter)
+
+    def list_keys(self) -> List[str]:
+        return [blob.name.split('/')[-1] for blob in self._blobs()]
+
+    def list_artifacts(self) -> ArtifactSet:
+        artifact_set = ArtifactSet(coffer=self)
+        if self.subset is not None:
+            for key in sorted(self.subset):
+                artifact_set.append(key, self.subset[key], infer_type(key))
+            return artifact_set
+        bucket = self.storage_client.get_bucket(self.bucket_name)
+        for blob in bucket.list_blobs(prefix=self.path):
+            key = blob.name.split('/')[-1]
+            artifact_set.append(key, blob.size, infer_type(key))
+        return artifact_set
+
+    def copy_to(self, other: Coffer, keys: List[str] = None, max_workers: int = 8):
+        """
+        Copies artifacts from this coffer into another one. If the other coffer is also a
+        GCSCoffer, objects are copied server-side using up to max_workers parallel
+        rewrites, so no data passes through this machine. The rewrites share this
+        coffer's limiter.
+        """
+        if not isinstance(other, GCSCoffer):
+            return super().copy_to(other, keys=keys)
+        if keys is None:
+            keys = self.list_keys()
+        gcs.copy_blobs(
+            self.bucket_name,
+            [os.path.join(self.path, key) for key in keys],
+            other.bucket_name,
+            [os.path.join(other.path, key) for key in keys],
+            max_workers=max_workers,
+            storage_client=self.storage_client,
+            limiter=self.limiter,
+        )
+
     def delete(self):
         """
         Deletes all artifacts in the Coffer.
         """
-        bucket = self.storage_client.get_bucket(self.bucket_name)
-        blobs = bucket.list_blobs(prefix=self.path)
-        for blob in blobs:
+        for blob in self._blobs():
             blob.delete()
+
+    def _blobs(self):
+        """
+        Returns the blobs for the artifacts visible through this coffer. If the coffer is a
+        shard, the blobs are constructed from its keys without listing the bucket.
+        """
+        bucket = self.storage_client.get_bucket(self.bucket_name)
+        if self.subset is not None:
+            return [bucket.blob(os.path.join(self.path, key)) for key in sorted(self.subset)]
+        return bucket.list_blobs(prefix=self.path)
@@ -1,10 +1,13 @@
 import caboodle
-from caboodle import artifacts, coffer
+from caboodle import artifacts, coffer, gcs
+from caboodle.fakes_test import FakeClient
 from fireworks import Message
 import pickle
 import torch
+import numpy as np
 import os
 import io
+import json
 
 def test_Coffer():
 
@@ -36,4 +39,177 @@ def test_Coffer():
             fart_gallery_dict['binary'] = artifact.data                        
 
     for art, fart in zip(art_gallery_dict.values(), fart_gallery_dict.values()):
-        assert art == fart
\ No newline at end of file
+        assert art == fart
+
+def test_LocalCoffer_open(tmpdir):
+
+    p = [1,2,3,4,'hii']
+    coffee = coffer.LocalCoffer(str(tmpdir))
+    coffee.upload([artifacts.PickleArtifact('test.pickle', p)])
+    with coffee.open('test.pickle') as f:
+        assert artifacts.PickleArtifact('test.pickle').deserialize(f) == p
+
+def test_LocalCoffer_download_budget(tmpdir):
+
+    contents = [[i]*100 for i in range(4)]
+    coffee = coffer.LocalCoffer(str(tmpdir))
+    coffee.upload([artifacts.PickleArtifact('{0}.pickle'.format(i), c) for i, c in enumerate(contents)])
+    size = os.path.getsize(str(tmpdir.join('0.pickle')))
+    budgeted = coffee.download(memory_budget=size)
+    assert sorted(a.data for a in budgeted) == contents
+    assert budgeted.resident_bytes == size
+
+def test_GCSCoffer_upload_checksum():
+
+    client = FakeClient()
+    gcs_coffer = coffer.GCSCoffer('gs://bucket/output', storage_client=client)
+    client.corrupt_uploads = 1
+    try:
+        gcs_coffer.upload([artifacts.BinaryArtifact('a.bin', b'x' * 100)])
+        assert False
+    except gcs.DataCorruption:
+        pass
+    client.corrupt_uploads = 1
+    try:
+        gcs_coffer.write('b.bin', io.BytesIO(b'y' * 100))
+        assert False
+    except gcs.DataCorruption:
+        pass
+    gcs_coffer.write('b.bin', io.BytesIO(b'y' * 100))
+    assert gcs_coffer.open('b.bin').read() == b'y' * 100
+
+def test_GCSCoffer_download_budget(tmpdir):
+
+    client = FakeClient()
+    gcs_coffer = coffer.GCSCoffer('gs://bucket/input', storage_client=client)
+    gcs_coffer.upload([artifacts.BinaryArtifact('a.bin', b'x' * 100)])
+    budgeted = gcs_coffer.download(local_path=str(tmpdir), memory_budget=10)
+    assert budgeted[0].data == b'x' * 100
+    blob = client.get_bucket('bucket').blobs['input/a.bin']
+    def download_to_filename(filename):
+        with open(filename, 'wb') as f:
+            f.write(b'x' * 10)
+        raise ValueError("Simulated failure")
+    blob.download_to_filename = download_to_filename
+    try:
+        gcs_coffer.download(local_path=str(tmpdir.mkdir('partial')), memory_budget=10)
+        assert False
+    except ValueError:
+        pass
+    assert os.listdir(str(tmpdir.join('partial'))) == [] # The partial file is removed
+
+def test_copy_to(tmpdir):
+
+    p = [1,2,3,4,'hii']
+    b = b'hohohooh'
+    source = coffer.LocalCoffer(str(tmpdir.mkdir('source')))
+    source.upload([artifacts.PickleArtifact('test.pickle', p), artifacts.BinaryArtifact('test.bin', b)])
+    client = FakeClient()
+    gcs_coffer = coffer.GCSCoffer('gs://bucket/scratch', storage_client=client)
+    source.copy_to(gcs_coffer)
+    assert sorted(gcs_coffer.list_keys()) == ['test.bin', 'test.pickle']
+    release = coffer.GCSCoffer('gs://other/release', storage_client=client)
+    gcs_coffer.copy_to(release, keys=['test.pickle'])
+    assert release.list_keys() == ['test.pickle']
+    debug = coffer.DebugCoffer()
+    release.copy_to(debug)
+    assert debug.download()[0].data == p
+    local = coffer.LocalCoffer(str(tmpdir.mkdir('local')))
+    gcs_coffer.copy_to(local)
+    with open(str(tmpdir.join('local', 'test.bin')), 'rb') as f:
+        assert f.read() == b
+
+def test_list_artifacts(tmpdir):
+
+    contents = [[i]*(i+1)*10 for i in range(4)]
+    coffee = coffer.LocalCoffer(str(tmpdir))
+    coffee.upload([artifacts.PickleArtifact('{0}.pickle'.format(i), c) for i, c in enumerate(contents)])
+    coffee.upload([artifacts.BinaryArtifact('data.bin', b'hohohooh')])
+    artifact_set = coffee.list_artifacts()
+    assert len(artifact_set) == 5
+    pickles = artifact_set.where(artifact_type=artifacts.PickleArtifact).sort_by_size()
+    assert list(pickles) == ['0.pickle', '1.pickle', '2.pickle', '3.pickle']
+    loaded = pickles.load([1, 3])
+    assert [a.data for a in loaded] == [contents[1], contents[3]]
+    assert [a.data for a in pickles.load()] == contents
+    pickles.close()
+    assert pickles._loaded == {}
+    assert all(a._content is None for a in loaded)
+
+def test_load_stacked(tmpdir):
+
+    arrays = [np.random.rand(5, 3) for _ in range(10)]
+    keys = ['{0}.npy'.format(i) for i in range(10)]
+    local = coffer.LocalCoffer(str(tmpdir))
+    local.upload([artifacts.NumpyArtifact(key, a) for key, a in zip(keys, arrays)])
+    assert coffer.infer_type('0.npy') is artifacts.NumpyArtifact
+    assert (local.load_stacked(keys) == np.stack(arrays)).all()
+    gcs_coffer = coffer.GCSCoffer('gs://bucket/arrays', storage_client=FakeClient())
+    local.copy_to(gcs_coffer)
+    stacked = gcs_coffer.load_stacked(keys[::-1], max_workers=3)
+    assert (stacked == np.stack(arrays[::-1])).all()
+    local.upload([artifacts.NumpyArtifact('bad.npy', np.zeros((5, 4)))])
+    try:
+        local.load_stacked(keys + ['bad.npy'])
+        assert False
+    except ValueError:
+        pass
+
+def test_partition_by_size():
+
+    manifest = {'a': 100, 'b': 60, 'c': 50, 'd': 40, 'e': 10, 'f': 10}
+    groups = coffer.partition_by_size(manifest, 2)
+    assert groups == [['a', 'd'], ['b', 'c', 'e', 'f']]
+    assert coffer.partition_by_size(dict(reversed(list(manifest.items()))), 2) == groups
+    assert sorted(sum(coffer.partition_by_size(manifest, 4), [])) == sorted(manifest)
+    assert coffer.partition_by_size({}, 3) == [[], [], []]
+
+def test_shard(tmpdir):
+
+    client = FakeClient()
+    gcs_coffer = coffer.GCSCoffer('gs://bucket/input', storage_client=client)
+    contents = {'{0}.bin'.format(i): b'x' * (i * 10 + 1) for i in range(10)}
+    gcs_coffer.upload([artifacts.BinaryArtifact(key, data) for key, data in contents.items()])
+    manifest = gcs_coffer.manifest()
+    assert manifest == {key: len(data) for key, data in contents.items()}
+    manifest_path = str(tmpdir.join('manifest.json'))
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+    shards = [gcs_coffer.shard(i, 3, manifest=manifest_path) for i in range(3)]
+    downloaded = [{a.key: a.data for a in shard.download()} for shard in shards]
+    assert sum(len(d) for d in downloaded) == len(contents)
+    for d in downloaded:
+        assert all(contents[key] == data for key, data in d.items())
+    totals = [shard.list_artifacts().total_size for shard in shards]
+    assert max(totals) - min(totals) <= max(manifest.values())
+    assert gcs_coffer.shard(1, 3).list_keys() == shards[1].list_keys()
+    assert len(gcs_coffer.list_keys()) == len(contents) # The original coffer is unaffected
+
+    local = coffer.LocalCoffer(str(tmpdir.mkdir('local')))
+    gcs_coffer.copy_to(local)
+    local_shard = local.shard(0, 3)
+    assert sorted(local_shard.list_keys()) == sorted(downloaded[0])
+    assert {a.key for a in local_shard.download()} == set(downloaded[0])
+    try:
+        local.shard(3, 3)
+        assert False
+    except ValueError:
+        pass
+
+    debug = coffer.DebugCoffer()
+    debug.upload([artifacts.BinaryArtifact(key, data) for key, data in contents.items()])
+    debug.shard(0, 3, manifest=manifest).delete()
+    assert sorted(debug.list_keys()) == sorted(set(contents) - set(downloaded[0]))
+
+def test_appendable():
+
+    gcs_coffer = coffer.GCSCoffer('gs://bucket/output', storage_client=FakeClient())
+    log = gcs_coffer.appendable('results.bin', compact_every=2)
+    for i in range(5):
+        log.append(b'result ')
+    with gcs_coffer.open('results.bin') as f:
+        assert f.read() == b'result ' * 4
+    assert gcs_coffer.list_keys() == ['results.bin'] # Pending chunks are not artifacts
+    log.commit()
+    assert gcs_coffer.list_keys() == ['results.bin']
+    assert gcs_coffer.download()[0].data == b'result ' * 5
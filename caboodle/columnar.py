@@ -0,0 +1,245 @@
+from typing import Dict, List, Sequence, Tuple
+import itertools
+import pickle
+import struct
+import json
+import sys
+import io
+
+try:
+    import numpy as np
+    numpy_installed = True
+except ModuleNotFoundError:
+    numpy_installed = False
+
+magic = b'CABCOL02'
+# Every record ends with a footer containing its offset and length.
+footer = struct.Struct('<qq8s')
+
+class ColumnarFile():
+    """
+    A table of equal-length columns stored in a single file as row chunks. Each chunk holds
+    one pickled segment per column, followed by a small JSON record of the lengths of its
+    segments. An index record listing every chunk can be written at the end of the file
+    (see write_index). Readers find the chunks by walking back from the end of the file
+    to the last index record, so appending a chunk costs only the size of the chunk.
+
+    Reading a subset of the columns or rows only reads the segments which contain them.
+    GCS objects should be opened unbuffered (with buffer_size=0 in gcs.open_file or
+    GCSCoffer.open), so that each segment is fetched with one range read of exactly its
+    bytes instead of pulling in the neighbouring columns.
+
+    Columns can be any sliceable sequence, such as lists, NumPy arrays, torch tensors or
+    pandas Series.
+    """
+    def __init__(self, f: io.IOBase):
+        self.f = f
+        self.columns = []
+        self.chunks = [] # List of {'rows': ..., 'offset': ..., 'lengths': [...]}, with lengths in column order.
+        self.end = f.seek(0, io.SEEK_END)
+        self._index_offset = None # Offset of the index record, if it is the last record in the file.
+        if self.end:
+            self.columns, self.chunks, index_offset, trailing = read_table(f)
+            if not trailing:
+                self._index_offset = index_offset
+
+    def __len__(self) -> int:
+        return sum(chunk['rows'] for chunk in self.chunks)
+
+    def read(self, columns: List[str] = None, rows: slice = None) -> Dict[str, Sequence]:
+        """
+        Returns a dict mapping the names of the given columns (or all of them) to their
+        contents in the given slice of rows (or all of them). Only the segments which
+        overlap with the selected rows are read.
+        """
+        columns = self.columns if columns is None else list(columns)
+        for column in columns:
+            if column not in self.columns:
+                raise KeyError("Column {0} is not in the table (columns are {1}).".format(column, self.columns))
+        start, stop, step = (rows or slice(None)).indices(len(self))
+        if step != 1:
+            raise ValueError("Row slices must be contiguous.")
+        parts = {column: [] for column in columns}
+        chunk_start = 0
+        for chunk in self.chunks:
+            chunk_stop = chunk_start + chunk['rows']
+            if chunk_start < stop and start < chunk_stop:
+                first, last = max(start, chunk_start) - chunk_start, min(stop, chunk_stop) - chunk_start
+                for column in columns:
+                    i = self.columns.index(column)
+                    offset = chunk['offset'] + sum(chunk['lengths'][:i])
+                    self.f.seek(offset)
+                    segment = pickle.loads(_read_exactly(self.f, chunk['lengths'][i]))
+                    if (first, last) != (0, chunk['rows']):
+                        segment = segment[first:last]
+                    parts[column].append(segment)
+            chunk_start = chunk_stop
+        return {column: concatenate(parts[column]) for column in columns}
+
+    def append(self, columns: Dict[str, Sequence]):
+        """
+        Writes the given columns as a new row chunk at the end of the file. The first chunk
+        determines the columns of the table, and every later chunk must have the same
+        columns. If the file ended with an index record, it is overwritten, so write_index
+        should be called again once the appends are done.
+        """
+        _check_chunk(columns, self.columns if self.chunks else None)
+        if not self.chunks:
+            self.columns = list(columns)
+        if self._index_offset is not None:
+            self.end, self._index_offset = self._index_offset, None
+        data, chunk = encode_chunk(columns, self.columns, self.end)
+        self._write(data)
+        self.chunks.append(chunk)
+
+    def write_index(self):
+        """
+        Writes an index record of all chunks at the end of the file, so that readers do not
+        need to walk back over the chunk records.
+        """
+        if self._index_offset is not None or not self.chunks:
+            return
+        index_offset = self.end
+        self._write(encode_index(self.columns, self.chunks, index_offset))
+        self._index_offset = index_offset
+
+    def _write(self, data: bytes):
+        self.f.seek(self.end)
+        self.f.write(data)
+        self.f.truncate()
+        self.f.flush()
+        self.end += len(data)
+
+class ColumnarAppender():
+    """
+    Appends row chunks to a table stored in a gcs.AppendableBlob. Each append uploads only
+    the chunk and its record, and an index record is appended after every index_every
+    chunks, so readers walk back over at most index_every chunk records. Appended chunks
+    become visible to readers when the AppendableBlob commits them.
+    """
+    def __init__(self, appendable, index_every: int = 64):
+        self.appendable = appendable
+        self.index_every = index_every
+        appendable.commit() # The size of the object must include every pending chunk.
+        with appendable.open(buffer_size=0) as f:
+            self.end = f.seek(0, io.SEEK_END)
+            self.columns, self.chunks, _, self.trailing = read_table(f) if self.end else ([], [], None, 0)
+
+    def append(self, columns: Dict[str, Sequence]):
+        """ Appends the given columns as a new row chunk. """
+        _check_chunk(columns, self.columns if self.chunks else None)
+        if not self.chunks:
+            self.columns = list(columns)
+        data, chunk = encode_chunk(columns, self.columns, self.end)
+        self.appendable.append(data)
+        self.end += len(data)
+        self.chunks.append(chunk)
+        self.trailing += 1
+        if self.trailing >= self.index_every:
+            self.write_index()
+
+    def write_index(self):
+        """ Appends an index record of all chunks. """
+        if not self.trailing:
+            return
+        data = encode_index(self.columns, self.chunks, self.end)
+        self.appendable.append(data)
+        self.end += len(data)
+        self.trailing = 0
+
+    def commit(self):
+        """ Writes an index record and makes all appended chunks visible to readers. """
+        self.write_index()
+        self.appendable.commit()
+
+def read_table(f: io.IOBase) -> Tuple[List[str], List[dict], int, int]:
+    """
+    Reads the columns and chunks of a table by walking back over its records from the end
+    of a seekable file until an index record is found. Returns the columns, the chunks, the
+    offset of the last index record (or None) and the number of chunk records after it.
+    """
+    end = f.seek(0, io.SEEK_END)
+    columns, chunks, index_offset = None, [], None
+    trailing = []
+    while end > 0:
+        record_offset, record = _read_record(f, end)
+        if 'chunks' in record:
+            columns, chunks, index_offset = record['columns'], record['chunks'], record_offset
+            break
+        start = record_offset - sum(record['lengths'])
+        trailing.append((record['columns'], {'rows': record['rows'], 'offset': start, 'lengths': record['lengths']}))
+        end = start
+    for chunk_columns, chunk in reversed(trailing):
+        if columns is None:
+            columns = chunk_columns
+        elif chunk_columns != columns:
+            raise ValueError("Chunk at offset {0} has columns {1}, expected {2}.".format(chunk['offset'], chunk_columns, columns))
+        chunks.append(chunk)
+    return columns or [], chunks, index_offset, len(trailing)
+
+def encode_chunk(columns: Dict[str, Sequence], column_names: List[str], offset: int) -> Tuple[bytes, dict]:
+    """
+    Serializes a row chunk followed by its record. Returns the data to write and the
+    chunk's entry in the index, assuming the data is written at the given offset.
+    """
+    segments = [pickle.dumps(columns[name], protocol=pickle.HIGHEST_PROTOCOL) for name in column_names]
+    chunk = {'rows': len(columns[column_names[0]]), 'offset': offset, 'lengths': [len(s) for s in segments]}
+    record = {'rows': chunk['rows'], 'columns': column_names, 'lengths': chunk['lengths']}
+    data = b''.join(segments)
+    return data + _encode_record(record, offset + len(data)), chunk
+
+def encode_index(column_names: List[str], chunks: List[dict], offset: int) -> bytes:
+    """ Serializes an index record of the given chunks, to be written at offset. """
+    return _encode_record({'columns': column_names, 'chunks': chunks}, offset)
+
+def _encode_record(record: dict, offset: int) -> bytes:
+    data = json.dumps(record).encode('utf-8')
+    return data + footer.pack(offset, len(data), magic)
+
+def _read_record(f: io.IOBase, end: int) -> Tuple[int, dict]:
+    """ Reads the record whose footer ends at end. Returns its offset and contents. """
+    f.seek(end - footer.size)
+    record_offset, record_length, record_magic = footer.unpack(_read_exactly(f, footer.size))
+    if record_magic != magic:
+        raise ValueError("File is not a columnar table (found {0} instead of {1}).".format(record_magic, magic))
+    f.seek(record_offset)
+    return record_offset, json.loads(_read_exactly(f, record_length).decode('utf-8'))
+
+def _read_exactly(f: io.IOBase, length: int) -> bytearray:
+    """ Reads length bytes from f, which may be a raw stream returning short reads. """
+    data = bytearray(length)
+    view = memoryview(data)
+    filled = 0
+    while filled < length:
+        n = f.readinto(view[filled:])
+        if not n:
+            raise ValueError("Table ended {0} bytes early.".format(length - filled))
+        filled += n
+    return data
+
+def _check_chunk(columns: Dict[str, Sequence], expected: List[str] = None):
+    lengths = set(len(values) for values in columns.values())
+    if len(lengths) != 1:
+        raise ValueError("All columns in a chunk must have the same length (got {0}).".format(sorted(lengths)))
+    if expected is not None and set(columns) != set(expected):
+        raise ValueError("Chunk has columns {0}, expected {1}.".format(sorted(columns), sorted(expected)))
+
+def concatenate(parts: List[Sequence]) -> Sequence:
+    """
+    Concatenates the segments of a column, using the concatenation function of their type
+    for NumPy arrays, torch tensors and pandas objects.
+    """
+    if not parts:
+        return []
+    first = parts[0]
+    if 'pandas' in sys.modules and isinstance(first, (sys.modules['pandas'].Series, sys.modules['pandas'].DataFrame)):
+        return sys.modules['pandas'].concat(parts, ignore_index=True)
+    if len(parts) == 1:
+        return first
+    if 'torch' in sys.modules and isinstance(first, sys.modules['torch'].Tensor):
+        return sys.modules['torch'].cat(parts)
+    if numpy_installed and isinstance(first, np.ndarray):
+        return np.concatenate(parts)
+    if isinstance(first, tuple):
+        return tuple(itertools.chain.from_iterable(parts))
+    return list(itertools.chain.from_iterable(parts))
@@ -0,0 +1,104 @@
+from caboodle import columnar, gcs
+from caboodle.fakes_test import FakeClient, FakeBlob
+import numpy as np
+import io
+
+def test_ColumnarFile(tmpdir):
+
+    path = str(tmpdir.join('table'))
+    with open(path, 'wb') as f:
+        table = columnar.ColumnarFile(f)
+        table.append({'a': [0, 1, 2], 'b': np.arange(3)})
+        table.append({'a': [3, 4, 5], 'b': np.arange(3, 6)})
+    with open(path, 'r+b') as f:
+        table = columnar.ColumnarFile(f)
+        assert len(table) == 6
+        table.append({'b': np.arange(6, 8), 'a': [6, 7]})
+        try:
+            table.append({'a': [8]})
+            assert False
+        except ValueError:
+            pass
+        try:
+            table.append({'a': [8], 'b': np.arange(2)})
+            assert False
+        except ValueError:
+            pass
+    with open(path, 'rb') as f:
+        table = columnar.ColumnarFile(f)
+        assert table.columns == ['a', 'b']
+        assert len(table) == 8
+        everything = table.read()
+        assert everything['a'] == list(range(8))
+        assert (everything['b'] == np.arange(8)).all()
+        assert table.read(columns=['a'], rows=slice(2, 7)) == {'a': [2, 3, 4, 5, 6]}
+        assert table.read(columns=['a'], rows=slice(-1, None)) == {'a': [7]}
+        assert (table.read(columns=['b'], rows=slice(3, 6))['b'] == np.arange(3, 6)).all()
+        try:
+            table.read(columns=['c'])
+            assert False
+        except KeyError:
+            pass
+
+def test_ColumnarFile_index(tmpdir):
+
+    path = str(tmpdir.join('table'))
+    with open(path, 'w+b') as f:
+        table = columnar.ColumnarFile(f)
+        for start in range(0, 30, 10):
+            table.append({'a': list(range(start, start + 10))})
+        table.write_index()
+        size = table.end
+        table.append({'a': list(range(30, 40))}) # Overwrites the index
+        table.write_index()
+        assert table.end < size + size // 2 # The old index was not left behind
+    with open(path, 'rb') as f:
+        columns, chunks, index_offset, trailing = columnar.read_table(f)
+        assert (columns, len(chunks), trailing) == (['a'], 4, 0)
+        assert columnar.ColumnarFile(f).read(rows=slice(5, 35)) == {'a': list(range(5, 35))}
+
+def test_ColumnarFile_projection():
+
+    client = FakeClient()
+    bucket = client.get_bucket('bucket')
+    buffer = io.BytesIO()
+    table = columnar.ColumnarFile(buffer)
+    for start in range(0, 40, 10):
+        table.append({'small': list(range(start, start + 10)), 'large': [b'x' * 1000] * 10})
+    table.write_index()
+    blob = FakeBlob('tables/t', buffer.getvalue(), bucket=bucket)
+    with gcs.open_file('bucket', 'tables/t', buffer_size=0, storage_client=client) as f:
+        table = columnar.ColumnarFile(f)
+        blob.requests = []
+        assert table.read(columns=['small'], rows=slice(15, 25)) == {'small': list(range(15, 25))}
+    assert len(blob.requests) == 2 # Only the two chunks holding the selected rows
+    assert sum(end - start + 1 for start, end in blob.requests) < 1000 # None of the large column
+
+def test_ColumnarAppender():
+
+    client = FakeClient()
+    blob = gcs.AppendableBlob('bucket', 'tables/t.cfireworks', compact_every=4, storage_client=client)
+    table = columnar.ColumnarAppender(blob, index_every=3)
+    sizes = []
+    for i in range(10):
+        table.append({'a': [i, i], 'b': ['x' * 100] * 2})
+        sizes.append(table.end)
+    growth = [b - a for a, b in zip(sizes, sizes[1:])]
+    # Appends only upload their chunk, plus an index record after every third chunk.
+    assert [g > min(growth) for g in growth] == [k in (1, 4, 7) for k in range(9)]
+    try:
+        table.append({'a': [0]})
+        assert False
+    except ValueError:
+        pass
+    blob.commit()
+    # A restarted writer picks up where the last one left off.
+    table = columnar.ColumnarAppender(gcs.AppendableBlob('bucket', 'tables/t.cfireworks', storage_client=client), index_every=3)
+    assert (len(table.chunks), table.trailing) == (10, 1)
+    table.append({'b': ['y'], 'a': [10]})
+    table.commit()
+    with gcs.open_file('bucket', 'tables/t.cfireworks', buffer_size=0, storage_client=client) as f:
+        assert columnar.read_table(f)[3] == 0
+        table = columnar.ColumnarFile(f)
+        assert table.read(columns=['a']) == {'a': [i for i in range(10) for _ in range(2)] + [10]}
+        assert table.read(columns=['b'], rows=slice(20, 21)) == {'b': ['y']}
@@ -0,0 +1,269 @@
+from contextlib import contextmanager
+from typing import Callable
+import threading
+import asyncio
+import random
+import time
+
+try:
+    import requests
+    requests_installed = True
+except ModuleNotFoundError:
+    requests_installed = False
+try:
+    import aiohttp
+    aiohttp_installed = True
+except ModuleNotFoundError:
+    aiohttp_installed = False
+
+throttling_status_codes = {429, 503}
+transient_status_codes = {408, 429, 500, 502, 503, 504}
+transient_exceptions = (ConnectionError, TimeoutError, asyncio.TimeoutError)
+if requests_installed:
+    transient_exceptions += (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+if aiohttp_installed:
+    transient_exceptions += (aiohttp.ClientConnectionError,)
+
+def is_throttling_error(exception: Exception) -> bool:
+    """
+    Returns whether an exception raised by a storage client indicates that requests are
+    being throttled. This recognizes google.api_core exceptions (which have a code) and
+    aiohttp response errors (which have a status).
+    """
+    for attribute in ('code', 'status', 'status_code'):
+        if getattr(exception, attribute, None) in throttling_status_codes:
+            return True
+    return False
+
+def is_transient_error(exception: Exception) -> bool:
+    """
+    Returns whether a request which raised exception is worth retrying: it was throttled,
+    failed with a server error or timeout, or lost its connection.
+    """
+    if isinstance(exception, transient_exceptions):
+        return True
+    for attribute in ('code', 'status', 'status_code'):
+        if getattr(exception, attribute, None) in transient_status_codes:
+            return True
+    return False
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """
+    Returns a randomized delay in seconds before retry number attempt (starting from 0),
+    using exponential backoff with full jitter.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class AdaptiveLimit():
+    """
+    An additive-increase / multiplicative-decrease (AIMD) controller for the number of
+    concurrent requests to a storage backend. It can be shared by threads and by
+    coroutines on any event loop.
+
+    Completed requests are grouped into windows of limit requests. At the end of each
+    window, the limit is increased by increase if the throughput (bytes per second, or
+    requests per second if sizes are unknown) did not drop compared to the previous window.
+    The limit is multiplied by decrease when a request is throttled. If latency_tolerance
+    is set, it is also decreased when a request takes more than latency_tolerance times
+    the moving average time per byte (or per request, for requests of unknown size). This
+    is disabled by default because whole-object transfers vary in size by orders of
+    magnitude and have a fixed per-request overhead. It is best suited to requests of
+    similar sizes, such as fixed-size ranges. Decreases happen at most once per average
+    latency, so that a burst of failures from the same window only counts once.
+    """
+    def __init__(
+        self,
+        initial: int = 4,
+        minimum: int = 1,
+        maximum: int = 64,
+        increase: float = 1,
+        decrease: float = 0.5,
+        latency_tolerance: float = None,
+        smoothing: float = 0.2,
+        ):
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+        self.in_flight = 0
+        self.successes = 0
+        self.throttles = 0
+        self.errors = 0
+        self.latency = None # Moving average latency of successful requests in seconds.
+        self._cost = None # Moving average latency per byte of requests with known sizes.
+        self.throughput = None # Throughput of the last completed window.
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._async_waiters = []
+        self._last_decrease = None
+        self._reset_window()
+
+    @property
+    def current_limit(self) -> int:
+        """ The number of requests which may currently be in flight. """
+        return max(self.minimum, int(self.limit))
+
+    def metrics(self) -> dict:
+        """ Returns a snapshot of the state of the controller. """
+        with self._lock:
+            return {
+                'limit': self.current_limit,
+                'in_flight': self.in_flight,
+                'successes': self.successes,
+                'throttles': self.throttles,
+                'errors': self.errors,
+                'latency': self.latency,
+                'throughput': self.throughput,
+            }
+
+    def acquire(self):
+        """ Blocks until a request can be started. """
+        with self._condition:
+            while self.in_flight >= self.current_limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        """ Waits until a request can be started without blocking the event loop. """
+        loop = asyncio.get_event_loop()
+        while True:
+            with self._lock:
+                if self.in_flight < self.current_limit:
+                    self.in_flight += 1
+                    return
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+            await future
+
+    def release(self, latency: float = None, size: int = 0, throttled: bool = False, error: bool = False):
+        """
+        Records the outcome of a request started with acquire and allows another to start.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            if throttled:
+                self.throttles += 1
+                self._decrease()
+            elif error:
+                self.errors += 1
+            else:
+                self.successes += 1
+                self._record_success(latency, size)
+            self._wake()
+
+    @contextmanager
+    def slot(self, size: int = 0):
+        """
+        A context manager which acquires a request slot for its body and records its
+        latency, or whether it was throttled if it raises an exception.
+        """
+        self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            throttled = is_throttling_error(e)
+            self.release(throttled=throttled, error=not throttled)
+            raise
+        self.release(latency=time.monotonic() - start, size=size)
+
+    def call(self, function: Callable, *args, size: int = 0, retries: int = 3, **kwargs):
+        """
+        Calls function(*args, **kwargs) in a request slot, retrying up to retries times with
+        jittered exponential backoff if it raises a transient error (see is_transient_error).
+        Other errors are raised immediately.
+        """
+        for attempt in range(retries + 1):
+            try:
+                with self.slot(size=size):
+                    return function(*args, **kwargs)
+            except Exception as e:
+                if attempt == retries or not is_transient_error(e):
+                    raise
+            time.sleep(backoff_delay(attempt))
+
+    async def call_async(self, function: Callable, *args, size: int = 0, retries: int = 3, **kwargs):
+        """
+        Awaits function(*args, **kwargs) in a request slot, retrying up to retries times
+        with jittered exponential backoff if it raises a transient error.
+        """
+        for attempt in range(retries + 1):
+            await self.acquire_async()
+            start = time.monotonic()
+            try:
+                result = await function(*args, **kwargs)
+            except Exception as e:
+                throttled = is_throttling_error(e)
+                self.release(throttled=throttled, error=not throttled)
+                if attempt == retries or not is_transient_error(e):
+                    raise
+            else:
+                self.release(latency=time.monotonic() - start, size=size)
+                return result
+            await asyncio.sleep(backoff_delay(attempt))
+
+    def _record_success(self, latency: float, size: int):
+        if latency is not None:
+            if size: # Compare time per byte, so that large transfers are not mistaken for spikes.
+                spike = self._is_spike(latency / size, self._cost)
+                self._cost = self._average(self._cost, latency / size)
+            else:
+                spike = self._is_spike(latency, self.latency)
+            if spike:
+                self._decrease()
+            self.latency = self._average(self.latency, latency)
+        self._window_bytes += size
+        self._window_requests += 1
+        if self._window_requests >= self.current_limit:
+            elapsed = max(time.monotonic() - self._window_start, 1e-9)
+            throughput = (self._window_bytes or self._window_requests) / elapsed
+            if self.throughput is None or throughput >= self.throughput:
+                self.limit = min(self.maximum, self.limit + self.increase)
+            self.throughput = throughput
+            self._reset_window()
+
+    def _is_spike(self, value: float, average: float) -> bool:
+        return self.latency_tolerance is not None and average is not None \
+            and value > self.latency_tolerance * average
+
+    def _average(self, average: float, value: float) -> float:
+        if average is None:
+            return value
+        return (1 - self.smoothing) * average + self.smoothing * value
+
+    def _decrease(self):
+        now = time.monotonic()
+        if self._last_decrease is not None and now - self._last_decrease < (self.latency or 0):
+            return
+        self.limit = max(self.minimum, self.limit * self.decrease)
+        self._last_decrease = now
+        self._reset_window()
+
+    def _reset_window(self):
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_requests = 0
+
+    def _wake(self):
+        self._condition.notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_set_done, future)
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(None)
+
+@contextmanager
+def limited(limiter: AdaptiveLimit = None, size: int = 0):
+    """
+    Runs the body in a request slot of limiter, or without any limit if it is None.
+    """
+    if limiter is None:
+        yield
+    else:
+        with limiter.slot(size=size):
+            yield
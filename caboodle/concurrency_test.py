@@ -0,0 +1,152 @@
+from caboodle import concurrency
+from caboodle.concurrency import AdaptiveLimit
+import threading
+import asyncio
+import time
+
+class ThrottlingError(Exception):
+
+    def __init__(self, code):
+        self.code = code
+
+def test_backoff_delay():
+
+    for attempt in range(10):
+        delay = concurrency.backoff_delay(attempt, base=0.5, cap=4.0)
+        assert 0 <= delay <= min(4.0, 0.5 * 2 ** attempt)
+
+def test_is_throttling_error():
+
+    assert concurrency.is_throttling_error(ThrottlingError(429))
+    assert concurrency.is_throttling_error(ThrottlingError(503))
+    assert not concurrency.is_throttling_error(ThrottlingError(404))
+    assert not concurrency.is_throttling_error(ValueError())
+    assert concurrency.is_transient_error(ThrottlingError(500))
+    assert concurrency.is_transient_error(ConnectionError())
+    assert not concurrency.is_transient_error(ThrottlingError(404))
+    assert not concurrency.is_transient_error(ValueError())
+
+def test_AdaptiveLimit_increase():
+
+    limiter = AdaptiveLimit(initial=2, maximum=4, latency_tolerance=None)
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release(latency=0.0, size=1)
+    assert limiter.current_limit == 4 # Capped at the maximum
+    assert limiter.metrics()['successes'] == 20
+
+def test_AdaptiveLimit_decrease():
+
+    limiter = AdaptiveLimit(initial=8, minimum=2)
+    limiter.acquire()
+    limiter.release(latency=60.0)
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter.current_limit == 4
+    limiter.acquire()
+    limiter.release(throttled=True) # Within the same average latency, so ignored
+    assert limiter.current_limit == 4
+    limiter._last_decrease = None
+    limiter.acquire()
+    limiter.release(throttled=True)
+    limiter._last_decrease = None
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter.current_limit == 2 # Capped at the minimum
+    metrics = limiter.metrics()
+    assert metrics['throttles'] == 4
+    assert metrics['in_flight'] == 0
+
+    limiter = AdaptiveLimit(initial=8, latency_tolerance=3.0)
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release(latency=0.01, size=1000)
+    limiter.acquire()
+    limiter.release(latency=1.0, size=10**6) # Slower, but not per byte
+    assert limiter.current_limit == 8
+    limiter._last_decrease = None
+    limiter.acquire()
+    limiter.release(latency=1.0, size=1000) # Latency spike
+    assert limiter.current_limit == 4
+    limiter = AdaptiveLimit(initial=8)
+    for latency in (0.01, 0.01, 1.0):
+        limiter.acquire()
+        limiter.release(latency=latency)
+    assert limiter.current_limit == 8 # Latency checks are disabled by default
+
+def test_AdaptiveLimit_acquire():
+
+    limiter = AdaptiveLimit(initial=2, maximum=2)
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def work():
+        with limiter.slot():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.pop()
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 2
+    assert limiter.metrics()['successes'] == 8
+
+def test_AdaptiveLimit_acquire_async():
+
+    limiter = AdaptiveLimit(initial=2, maximum=2)
+    running = []
+    peak = []
+
+    async def work(i):
+        async def request():
+            running.append(i)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(i)
+            return i
+        return await limiter.call_async(request)
+
+    async def main():
+        return await asyncio.gather(*[work(i) for i in range(8)])
+
+    loop = asyncio.new_event_loop()
+    assert loop.run_until_complete(main()) == list(range(8))
+    loop.close()
+    assert max(peak) == 2
+
+def test_AdaptiveLimit_call(monkeypatch):
+
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+    limiter = AdaptiveLimit(initial=4)
+    failures = [ThrottlingError(429), ConnectionError()]
+
+    def request(x):
+        if failures:
+            raise failures.pop(0)
+        return x
+
+    assert limiter.call(request, 5, retries=2) == 5
+    metrics = limiter.metrics()
+    assert (metrics['throttles'], metrics['errors'], metrics['successes']) == (1, 1, 1)
+    assert limiter.current_limit == 2
+    failures = [ConnectionError()] * 2
+    try:
+        limiter.call(request, 5, retries=1)
+        assert False
+    except ConnectionError:
+        pass
+    failures = [ThrottlingError(404), ThrottlingError(404)]
+    try:
+        limiter.call(request, 5, retries=3)
+        assert False
+    except ThrottlingError:
+        pass
+    assert len(failures) == 1 # Not retried
+    assert limiter.metrics()['in_flight'] == 0
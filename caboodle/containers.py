@@ -0,0 +1,352 @@
+from caboodle.artifacts import Artifact
+from caboodle.concurrency import limited
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from typing import List, Type, Iterable, Callable
+import io
+import os
+import shutil
+import tempfile
+
+try:
+    import numpy as np
+    numpy_installed = True
+except ModuleNotFoundError:
+    numpy_installed = False
+
+class BudgetedArtifactList(Sequence):
+    """
+    A list of artifacts which keeps at most memory_budget bytes worth of artifacts
+    deserialized at a time. When the budget is exceeded, the least recently accessed
+    artifacts are evicted by calling Artifact.close(), and are transparently reloaded
+    when they are accessed again. Artifacts which are not backed by a file on disk are
+    serialized to a temporary spill folder before being evicted, and are reloaded from there;
+    their path_or_buffer is left unchanged. Artifacts are only evicted without spilling if
+    their current content was loaded from a file which still exists; changes made to such
+    content in place are not detected and are lost on eviction.
+
+    The size of an artifact is measured as the size of its serialized representation.
+    """
+    def __init__(self, memory_budget: int, spill_dir: str = None):
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.resident_bytes = 0
+        self._artifacts = []
+        self._sizes = []
+        self._resident = OrderedDict() # Indices of deserialized artifacts, least recently used first.
+        self._loaded = {} # Index -> content which was loaded from the artifact's file.
+        self._spilled = {} # Index -> path in the spill folder holding the artifact's content.
+        self._spill_folder = None
+        self._spill_count = 0
+
+    @property
+    def spill_folder(self) -> str:
+        """
+        The temporary folder that artifacts are spilled to. This is created on first use.
+        """
+        if self._spill_folder is None:
+            self._spill_folder = tempfile.mkdtemp(prefix='caboodle-spill-', dir=self.spill_dir)
+        return self._spill_folder
+
+    def spill_path(self, key: str) -> str:
+        """
+        Returns a new path in the spill folder which can be used to store the raw bytes of
+        the artifact with the given key.
+        """
+        path = os.path.join(self.spill_folder, "{0}-{1}".format(self._spill_count, key))
+        self._spill_count += 1
+        return path
+
+    def append(self, artifact: Type[Artifact]):
+        """
+        Adds an artifact to the list. If the artifact is already deserialized, it counts
+        towards the memory budget; otherwise it will be loaded when first accessed.
+        """
+        index = len(self._artifacts)
+        self._artifacts.append(artifact)
+        self._sizes.append(self._measure(artifact))
+        if artifact._content is not None:
+            self._resident[index] = None
+            self.resident_bytes += self._sizes[index]
+            self._enforce_budget(keep=index)
+
+    def extend(self, artifacts: List[Type[Artifact]]):
+        for artifact in artifacts:
+            self.append(artifact)
+
+    def __len__(self) -> int:
+        return len(self._artifacts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        artifact = self._artifacts[index]
+        if index in self._resident:
+            self._resident.move_to_end(index)
+        else:
+            if index in self._spilled:
+                artifact._content = artifact.deserialize(self._spilled[index])
+            else:
+                artifact.load()
+            if self._source(index) is not None:
+                self._loaded[index] = artifact._content
+            self._resident[index] = None
+            self.resident_bytes += self._sizes[index]
+            self._enforce_budget(keep=index)
+        return artifact
+
+    def evict(self, index: int):
+        """
+        Closes the artifact at the given index, spilling it to disk first if necessary.
+        """
+        if index not in self._resident:
+            return
+        artifact = self._artifacts[index]
+        if not self._is_saved(index):
+            path = self.spill_path(artifact.key)
+            artifact.serialize(path)
+            if index in self._spilled:
+                os.remove(self._spilled[index])
+            self._spilled[index] = path
+        artifact._content = None
+        self._loaded.pop(index, None)
+        del self._resident[index]
+        self.resident_bytes -= self._sizes[index]
+
+    def cleanup(self):
+        """
+        Closes all artifacts and deletes the spill folder. Spilled artifacts which are not
+        resident lose their content, and are reloaded from their own path_or_buffer if they
+        are accessed again.
+        """
+        for index in list(self._resident):
+            if self._is_saved(index) and index not in self._spilled:
+                self._artifacts[index].close()
+        self._loaded.clear()
+        self._spilled.clear()
+        self._resident.clear()
+        self.resident_bytes = 0
+        if self._spill_folder is not None:
+            shutil.rmtree(self._spill_folder, ignore_errors=True)
+            self._spill_folder = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cleanup()
+
+    def _is_saved(self, index: int) -> bool:
+        """
+        Returns whether the content of the artifact at index was loaded from its file, so it
+        can be closed and reloaded without spilling it.
+        """
+        source = self._source(index)
+        return index in self._loaded and self._loaded[index] is self._artifacts[index]._content \
+            and source is not None and os.path.isfile(source)
+
+    def _source(self, index: int) -> str:
+        """
+        Returns the path that the artifact at index is loaded from, or None if it is not
+        loaded from a file.
+        """
+        if index in self._spilled:
+            return self._spilled[index]
+        path = self._artifacts[index].path_or_buffer
+        return path if type(path) is str else None
+
+    def _measure(self, artifact: Type[Artifact]) -> int:
+        """
+        Returns the serialized size of an artifact in bytes.
+        """
+        if type(artifact.path_or_buffer) is str and os.path.isfile(artifact.path_or_buffer):
+            return os.path.getsize(artifact.path_or_buffer)
+        if isinstance(artifact.path_or_buffer, io.BytesIO):
+            return artifact.path_or_buffer.getbuffer().nbytes
+        buffer = io.BytesIO()
+        artifact.serialize(buffer)
+        return buffer.tell()
+
+    def _enforce_budget(self, keep: int = None):
+        """
+        Evicts least recently used artifacts until the resident size is within budget.
+        The artifact at index keep is never evicted.
+        """
+        for index in list(self._resident):
+            if self.resident_bytes <= self.memory_budget:
+                break
+            if index != keep:
+                self.evict(index)
+
+class ArtifactSet():
+    """
+    A compact, column-oriented listing of the artifacts in a coffer, intended for coffers
+    with millions of entries. Keys are stored in a single UTF-8 encoded buffer indexed by
+    an array of offsets, and sizes and types are stored in typed arrays, so an entry costs
+    a few bytes instead of a full Artifact object. Artifacts are only created when loaded.
+
+    The sizes and offsets columns are array.array objects, which can be viewed as NumPy
+    arrays without copying using numpy.frombuffer.
+    """
+    __slots__ = ('coffer', 'types', 'offsets', 'sizes', 'type_codes', '_key_data', '_loaded')
+
+    def __init__(self, coffer=None):
+        self.coffer = coffer
+        self.types = [] # Artifact types, indexed by the values in type_codes.
+        self.offsets = array('q', [0])
+        self.sizes = array('q')
+        self.type_codes = array('B')
+        self._key_data = bytearray()
+        self._loaded = {} # Index -> loaded Artifact
+
+    def append(self, key: str, size: int, artifact_type: Type[Artifact]):
+        """
+        Adds an entry for the artifact with the given key, serialized size and type.
+        """
+        if artifact_type not in self.types:
+            self.types.append(artifact_type)
+        self._key_data.extend(key.encode('utf-8'))
+        self.offsets.append(len(self._key_data))
+        self.sizes.append(size)
+        self.type_codes.append(self.types.index(artifact_type))
+
+    def __len__(self) -> int:
+        return len(self.sizes)
+
+    def __iter__(self) -> Iterable[str]:
+        return (self.key(i) for i in range(len(self)))
+
+    def key(self, index: int) -> str:
+        return self._key_data[self.offsets[index]:self.offsets[index+1]].decode('utf-8')
+
+    def size(self, index: int) -> int:
+        return self.sizes[index]
+
+    def artifact_type(self, index: int) -> Type[Artifact]:
+        return self.types[self.type_codes[index]]
+
+    @property
+    def total_size(self) -> int:
+        return sum(self.sizes)
+
+    def select(self, indices: Iterable[int]) -> 'ArtifactSet':
+        """
+        Returns a new ArtifactSet containing the entries at the given indices, in order.
+        """
+        selected = ArtifactSet(coffer=self.coffer)
+        selected.types = list(self.types)
+        if numpy_installed:
+            indices = np.asarray(indices if isinstance(indices, (np.ndarray, list)) else list(indices), dtype=np.int64)
+            offsets = np.frombuffer(self.offsets, dtype=np.int64)
+            starts, ends = offsets[indices], offsets[indices + 1]
+            new_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+            np.cumsum(ends - starts, out=new_offsets[1:])
+            with memoryview(self._key_data) as key_data: # Released so that _key_data can still grow.
+                selected._key_data = bytearray(b''.join(key_data[start:end] for start, end in zip(starts.tolist(), ends.tolist())))
+            selected.offsets = array('q', new_offsets.tobytes())
+            selected.sizes = array('q', np.frombuffer(self.sizes, dtype=np.int64)[indices].tobytes())
+            selected.type_codes = array('B', np.frombuffer(self.type_codes, dtype=np.uint8)[indices].tobytes())
+        else:
+            for i in indices:
+                i = int(i)
+                selected._key_data.extend(self._key_data[self.offsets[i]:self.offsets[i+1]])
+                selected.offsets.append(len(selected._key_data))
+                selected.sizes.append(self.sizes[i])
+                selected.type_codes.append(self.type_codes[i])
+        return selected
+
+    def filter(self, mask: Iterable[bool]) -> 'ArtifactSet':
+        """
+        Returns a new ArtifactSet containing the entries for which mask is True. The mask
+        can be any iterable of booleans, such as a NumPy array computed from the columns.
+        """
+        if numpy_installed:
+            return self.select(np.flatnonzero(np.asarray(mask if isinstance(mask, (np.ndarray, list)) else list(mask), dtype=bool)))
+        return self.select(i for i, keep in enumerate(mask) if keep)
+
+    def where(
+        self,
+        min_size: int = None,
+        max_size: int = None,
+        artifact_type: Type[Artifact] = None,
+        predicate: Callable[[str], bool] = None,
+        ) -> 'ArtifactSet':
+        """
+        Returns a new ArtifactSet containing the entries whose size is within [min_size,
+        max_size], whose type is artifact_type and whose key satisfies predicate. Any
+        criteria which are not provided are ignored.
+        """
+        if numpy_installed:
+            sizes = np.frombuffer(self.sizes, dtype=np.int64)
+            mask = np.ones(len(self), dtype=bool)
+            if min_size is not None:
+                mask &= sizes >= min_size
+            if max_size is not None:
+                mask &= sizes <= max_size
+            if artifact_type in self.types:
+                mask &= np.frombuffer(self.type_codes, dtype=np.uint8) == self.types.index(artifact_type)
+            elif artifact_type is not None:
+                mask[:] = False
+            indices = np.flatnonzero(mask)
+        else:
+            indices = [
+                i for i, size in enumerate(self.sizes)
+                if (min_size is None or size >= min_size)
+                and (max_size is None or size <= max_size)
+                and (artifact_type is None or self.types[self.type_codes[i]] is artifact_type)
+            ]
+        if predicate is not None:
+            indices = [i for i in indices if predicate(self.key(i))]
+        return self.select(indices)
+
+    def sort_by_size(self, reverse: bool = False) -> 'ArtifactSet':
+        """
+        Returns a new ArtifactSet with the entries sorted by size. Ties keep their order.
+        """
+        if numpy_installed:
+            sizes = np.frombuffer(self.sizes, dtype=np.int64)
+            indices = np.argsort(-sizes if reverse else sizes, kind='stable')
+        else:
+            indices = sorted(range(len(self)), key=self.sizes.__getitem__, reverse=reverse)
+        return self.select(indices)
+
+    def load(self, indices: Iterable[int] = None, max_workers: int = 8) -> List[Type[Artifact]]:
+        """
+        Loads and returns the artifacts at the given indices (or all of them) from the
+        coffer, reading up to max_workers artifacts in parallel (or fewer, if the coffer has
+        a limiter). Loaded artifacts are kept until close is called.
+        """
+        if indices is None:
+            indices = range(len(self))
+        indices = [int(i) for i in indices]
+        missing = [i for i in indices if i not in self._loaded]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for i, artifact in zip(missing, executor.map(self._load_one, missing)):
+                self._loaded[i] = artifact
+        return [self._loaded[i] for i in indices]
+
+    def close(self, indices: Iterable[int] = None):
+        """
+        Releases the loaded artifacts at the given indices (or all of them). Their content
+        is dropped, so they must be loaded again to be used.
+        """
+        if indices is None:
+            indices = list(self._loaded)
+        for i in indices:
+            artifact = self._loaded.pop(int(i), None)
+            if artifact is not None:
+                artifact.close()
+                artifact._content = None # Not backed by a file, so close alone keeps it.
+
+    def _load_one(self, index: int) -> Type[Artifact]:
+        if self.coffer is None:
+            raise ValueError("This ArtifactSet is not associated with a coffer to load from.")
+        key = self.key(index)
+        artifact_type = self.artifact_type(index)
+        with limited(self.coffer.limiter, size=self.sizes[index]), self.coffer.open(key) as f:
+            content = artifact_type(key).deserialize(f)
+        return artifact_type(key, content)
@@ -0,0 +1,91 @@
+from caboodle import artifacts, containers
+import os
+
+def test_BudgetedArtifactList():
+
+    contents = [[i]*100 for i in range(5)]
+    arts = [artifacts.PickleArtifact('{0}.pickle'.format(i), c) for i, c in enumerate(contents)]
+    size = containers.BudgetedArtifactList(0)._measure(arts[0])
+    with containers.BudgetedArtifactList(2*size) as budgeted:
+        budgeted.extend(arts)
+        assert len(budgeted) == 5
+        assert budgeted.resident_bytes <= 2*size
+        assert [a._content is not None for a in arts] == [False, False, False, True, True]
+        spill_folder = budgeted.spill_folder
+        assert len(os.listdir(spill_folder)) == 3
+        assert budgeted[0].data == contents[0] # Reloaded from the spill folder
+        assert arts[3]._content is None
+        assert [a.data for a in budgeted] == contents
+        assert budgeted[-1] is arts[-1]
+        assert budgeted.resident_bytes <= 2*size
+    assert not os.path.exists(spill_folder)
+
+def test_BudgetedArtifactList_disk_backed(tmpdir):
+
+    arts = []
+    for i in range(3):
+        art = artifacts.BinaryArtifact(str(i), b'x'*10, path_or_buffer=str(tmpdir.join(str(i))))
+        art.save()
+        art.close()
+        arts.append(art)
+    budgeted = containers.BudgetedArtifactList(15)
+    budgeted.extend(arts)
+    assert budgeted.resident_bytes == 0
+    assert budgeted[0].data == b'x'*10
+    assert budgeted[1].data == b'x'*10
+    assert arts[0]._content is None
+    assert budgeted.resident_bytes == 10
+    budgeted.cleanup()
+    assert budgeted._spill_folder is None
+
+def test_BudgetedArtifactList_unsaved(tmpdir):
+
+    unsaved = artifacts.PickleArtifact('a', [1]*100, path_or_buffer=str(tmpdir.join('unsaved.pickle')))
+    changed = artifacts.PickleArtifact('b', [2]*100, path_or_buffer=str(tmpdir.join('b.pickle')))
+    changed.save()
+    changed.close()
+    with containers.BudgetedArtifactList(0) as budgeted:
+        budgeted.extend([unsaved, changed])
+        budgeted[1]._content = [3]*100 # Replaces the content loaded from disk
+        budgeted[0] # Evicts the changed artifact
+        assert budgeted[1].data == [3]*100
+        assert budgeted[0].data == [1]*100
+        assert unsaved.path_or_buffer == str(tmpdir.join('unsaved.pickle')) # Spill paths are not exposed
+        assert changed.path_or_buffer == str(tmpdir.join('b.pickle'))
+    assert changed.load() == [2]*100 # The file passed in is left as it was
+
+def test_ArtifactSet():
+
+    numpy_installed = containers.numpy_installed
+    artifact_set = containers.ArtifactSet()
+    sizes = [30, 10, 20, 10]
+    for i, size in enumerate(sizes):
+        artifact_type = artifacts.PickleArtifact if i % 2 else artifacts.BinaryArtifact
+        artifact_set.append('key{0}'.format(i), size, artifact_type)
+    assert len(artifact_set) == 4
+    assert list(artifact_set) == ['key0', 'key1', 'key2', 'key3']
+    assert artifact_set.total_size == 70
+    assert artifact_set.artifact_type(1) is artifacts.PickleArtifact
+    assert list(artifact_set.sort_by_size()) == ['key1', 'key3', 'key2', 'key0']
+    assert list(artifact_set.sort_by_size(reverse=True)) == ['key0', 'key2', 'key1', 'key3']
+    assert list(artifact_set.where(min_size=15)) == ['key0', 'key2']
+    assert list(artifact_set.where(max_size=20, artifact_type=artifacts.PickleArtifact)) == ['key1', 'key3']
+    assert list(artifact_set.where(predicate=lambda key: key.endswith('2'))) == ['key2']
+    assert list(artifact_set.filter([True, False, False, True])) == ['key0', 'key3']
+    assert list(artifact_set.filter(size > 15 for size in sizes)) == ['key0', 'key2']
+    if containers.numpy_installed:
+        import numpy as np
+        mask = np.frombuffer(artifact_set.sizes, dtype=np.int64) == 10
+        assert list(artifact_set.filter(mask)) == ['key1', 'key3']
+    containers.numpy_installed = False
+    try:
+        assert list(artifact_set.sort_by_size()) == ['key1', 'key3', 'key2', 'key0']
+        assert list(artifact_set.where(min_size=15)) == ['key0', 'key2']
+    finally:
+        containers.numpy_installed = numpy_installed
+    selected = artifact_set.select([3, 0])
+    assert (list(selected), list(selected.sizes)) == (['key3', 'key0'], [10, 30])
+    assert selected.artifact_type(0) is artifacts.PickleArtifact
+    empty = containers.ArtifactSet()
+    assert len(empty.sort_by_size()) == 0
+    assert len(empty.where(min_size=1, artifact_type=artifacts.BinaryArtifact)) == 0
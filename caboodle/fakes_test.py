@@ -0,0 +1,195 @@
+from caboodle import gcs
+from google.api_core.exceptions import NotFound
+import copy
+
+class FakeBlob():
+    """
+    Minimal in-memory stand-in for a google.cloud.storage Blob.
+    """
+    rewrite_chunk = 10 # Rewrites of larger objects need a continuation token.
+    component_limit = 1024 # GCS rejects composing objects with more components than this.
+
+    def __init__(self, name, data=None, bucket=None):
+        self.name = name
+        self.data = data
+        self.bucket = bucket
+        self.generation = 1
+        self.metadata = None
+        self.component_count = None
+        self.content_encoding = None
+        self.requests = []
+        if data is not None and bucket is not None:
+            bucket.blobs[name] = self
+
+    @property
+    def size(self):
+        return None if self.data is None else len(self.data)
+
+    @property
+    def crc32c(self):
+        return None if self.data is None else gcs.encode_crc32c(gcs.crc32c(self.data))
+
+    def reload(self):
+        current = self.bucket.blobs[self.name]
+        self.data, self.generation = current.data, current.generation
+
+    def exists(self):
+        return self.name in self.bucket.blobs
+
+    def download_as_string(self, start=None, end=None):
+        self.requests.append((start, end))
+        current = self.bucket.blobs.get(self.name) if self.bucket is not None else self
+        if current is None or current.generation != self.generation: # Reads are pinned to a generation.
+            raise NotFound("No such object: {0}#{1}".format(self.name, self.generation))
+        start = start or 0
+        end = len(self.data) - 1 if end is None else end
+        return self.data[start:end+1]
+
+    def download_to_filename(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(self.data)
+
+    def upload_from_string(self, data):
+        client = self.bucket.client
+        if client is not None and client.corrupt_uploads > 0:
+            client.corrupt_uploads -= 1
+            data = data + b'!'
+        if self.data is not None:
+            self.generation += 1
+        self.data = data
+        self.component_count = None
+        self.bucket.blobs[self.name] = self
+
+    def upload_from_filename(self, filename):
+        with open(filename, 'rb') as f:
+            self.upload_from_string(f.read())
+
+    def create_resumable_upload_session(self, size=None):
+        return self.bucket.client._http.create_session(self, size)
+
+    def upload_from_file(self, file_obj, size=None):
+        self.upload_from_string(file_obj.read())
+
+    def compose(self, sources):
+        assert len(sources) <= 32
+        data = b''.join(source.bucket.blobs[source.name].data for source in sources)
+        count = sum(source.bucket.blobs[source.name].component_count or 1 for source in sources)
+        if count > self.component_limit:
+            raise ValueError("400 The number of components would exceed {0}".format(self.component_limit))
+        self.upload_from_string(data)
+        self.component_count = count
+
+    def rewrite(self, source, token=None):
+        source.reload()
+        if token is None and source.size > self.rewrite_chunk:
+            return 'token', self.rewrite_chunk, source.size
+        self.upload_from_string(source.data)
+        return None, source.size, source.size
+
+    def delete(self):
+        del self.bucket.blobs[self.name]
+
+class FakeBucket():
+
+    def __init__(self, name, client=None):
+        self.name = name
+        self.client = client
+        self.blobs = {}
+        self.pin_generations = False # Whether get_blob returns snapshots which go stale when the object changes.
+
+    def blob(self, name):
+        if name in self.blobs:
+            return self.blobs[name]
+        return FakeBlob(name, bucket=self)
+
+    def get_blob(self, name):
+        if self.pin_generations and name in self.blobs:
+            return copy.copy(self.blobs[name]) # A snapshot, like the metadata returned by GCS.
+        return self.blobs.get(name)
+
+    def list_blobs(self, prefix=''):
+        return [self.blobs[name] for name in sorted(self.blobs) if name.startswith(prefix)]
+
+class FakeResponse():
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = ''
+
+class FakeTransport():
+    """
+    Implements the GCS resumable upload protocol in memory. Each chunk PUT persists
+    at most persist_limit bytes to simulate partially committed chunks.
+    """
+    def __init__(self):
+        self.sessions = {}
+        self.persist_limit = None
+        self.requests = []
+        self.failures = [] # Status codes to respond with, in order, before handling requests.
+
+    def create_session(self, blob, size):
+        url = 'session-{0}'.format(len(self.sessions))
+        self.sessions[url] = (blob, bytearray())
+        return url
+
+    def put(self, url, data=b'', headers=None):
+        self.requests.append((url, headers['Content-Range']))
+        if self.failures:
+            return FakeResponse(self.failures.pop(0))
+        if url not in self.sessions:
+            return FakeResponse(404)
+        blob, received = self.sessions[url]
+        content_range, size = headers['Content-Range'][len('bytes '):].split('/')
+        if content_range != '*':
+            start = int(content_range.split('-')[0])
+            assert start == len(received)
+            received.extend(data[:self.persist_limit])
+        if len(received) == int(size):
+            blob.upload_from_string(bytes(received))
+            return FakeResponse(200)
+        if len(received) == 0:
+            return FakeResponse(308)
+        return FakeResponse(308, {'Range': 'bytes=0-{0}'.format(len(received) - 1)})
+
+class FakeClient():
+    """
+    Minimal in-memory stand-in for a google.cloud.storage Client.
+    """
+    def __init__(self):
+        self.buckets = {}
+        self._http = FakeTransport()
+        self.fail_after = None # Number of downloads to allow before raising an error.
+        self.corrupt = 0 # Number of downloads to corrupt.
+        self.corrupt_uploads = 0 # Number of uploads to corrupt.
+
+    def get_bucket(self, name):
+        if name not in self.buckets:
+            self.buckets[name] = FakeBucket(name, client=self)
+        return self.buckets[name]
+
+    def download_blob_to_file(self, blob, file_obj, start=None, end=None):
+        if self.fail_after is not None:
+            if self.fail_after == 0:
+                raise ConnectionError("Simulated preemption")
+            self.fail_after -= 1
+        data = blob.download_as_string(start=start, end=end)
+        if self.corrupt > 0:
+            self.corrupt -= 1
+            data = data[::-1] + b'!'
+        file_obj.write(data)
+
+class FakeAioStorage():
+    """
+    Minimal stand-in for a gcloud.aio.storage Storage client.
+    """
+    def __init__(self, client):
+        self.client = client
+        self.corrupt = 0
+
+    async def download(self, bucket_name, name, timeout=None):
+        data = self.client.get_bucket(bucket_name).blobs[name].data
+        if self.corrupt > 0:
+            self.corrupt -= 1
+            return data + b'!'
+        return data
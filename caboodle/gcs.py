@@ -1,6 +1,7 @@
 # Imports the Google Cloud client library
 from google.cloud import storage
 from google.resumable_media import DataCorruption
+from google.api_core.exceptions import NotFound, from_http_status
 from gcloud.aio.storage import Storage
 from typing import List, Tuple, Union
 import io
@@ -13,10 +14,24 @@ import aiofiles
 import time
 import uvloop
 import itertools
+import json
+import base64
+import struct
 from itertools import count
+from concurrent.futures import ThreadPoolExecutor
+from caboodle.concurrency import AdaptiveLimit, backoff_delay, is_transient_error
+import threading
+
+try:
+    import google_crc32c
+    crc32c_installed = True
+except ModuleNotFoundError:
+    crc32c_installed = False
 
 uvloop.install()
 
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024 # Bytes per request for resumable transfers. Must be a multiple of 256 KiB.
+
 def printv(*args, verbose=True, **kwargs):
     if verbose:
         print(*args, **kwargs)
@@ -39,6 +54,196 @@ def get_storage_client():
     return storage_client
 
 
+def _make_crc32c_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+_crc32c_table = _make_crc32c_table()
+
+def crc32c(data: bytes, crc: int = 0) -> int:
+    """
+    Returns the CRC32C checksum of data, continuing from the checksum crc of any
+    preceding data. This uses the google-crc32c package if it is installed and
+    otherwise falls back to a (slow) pure Python implementation.
+    """
+    if crc32c_installed:
+        return google_crc32c.extend(crc, bytes(data))
+    crc ^= 0xFFFFFFFF
+    for byte in bytes(data):
+        crc = _crc32c_table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+def should_verify(blob, require_fast: bool = True) -> bool:
+    """
+    Returns whether a download of blob can be checked against its CRC32C. Objects stored
+    with gzip content encoding may be decompressed in transit, so their checksum does not
+    match the downloaded bytes. If require_fast is set, checksums are also skipped when
+    google-crc32c is not installed, since the pure Python fallback is much slower than
+    the network.
+    """
+    if blob.crc32c is None or getattr(blob, 'content_encoding', None) == 'gzip':
+        return False
+    return crc32c_installed or not require_fast
+
+def encode_crc32c(crc: int) -> str:
+    """ Encodes a CRC32C checksum in the base64 format used by GCS object metadata. """
+    return base64.b64encode(struct.pack('>I', crc)).decode('utf-8')
+
+def file_crc32c(filename: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> str:
+    """ Returns the base64 encoded CRC32C checksum of a local file. """
+    crc = 0
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            crc = crc32c(chunk, crc)
+    return encode_crc32c(crc)
+
+class Crc32cWriter():
+    """
+    Wraps a writable binary file and incrementally computes the CRC32C checksum of
+    everything written through it, starting from the checksum crc of existing data.
+    """
+    def __init__(self, file_obj, crc: int = 0):
+        self.file_obj = file_obj
+        self.crc = crc
+
+    def write(self, data) -> int:
+        self.crc = crc32c(data, self.crc)
+        return self.file_obj.write(data)
+
+    def tell(self) -> int:
+        return self.file_obj.tell()
+
+    def flush(self):
+        self.file_obj.flush()
+
+    @property
+    def checksum(self) -> str:
+        """ The base64 encoded checksum, in the format used by GCS object metadata. """
+        return encode_crc32c(self.crc)
+
+class Crc32cReader():
+    """
+    Wraps a readable binary file and incrementally computes the CRC32C checksum of the data
+    read from it, starting at its current position. Data which is read again after seeking
+    back, as an upload does when it resends a chunk, is only counted once.
+    """
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+        self.crc = 0
+        self.checked = file_obj.tell() # Position up to which data has been checksummed.
+
+    def read(self, size: int = -1) -> bytes:
+        position = self.file_obj.tell()
+        data = self.file_obj.read(size)
+        if position <= self.checked < position + len(data):
+            self.crc = crc32c(memoryview(data)[self.checked - position:], self.crc)
+            self.checked = position + len(data)
+        return data
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self.file_obj.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.file_obj.tell()
+
+    @property
+    def checksum(self) -> str:
+        """ The base64 encoded checksum, in the format used by GCS object metadata. """
+        return encode_crc32c(self.crc)
+
+def verify_upload(blob, checksum: str, source: str, limiter: AdaptiveLimit = None):
+    """
+    Reloads the metadata of an uploaded blob and raises DataCorruption if its CRC32C does
+    not match checksum, the checksum of the data which was sent from source.
+    """
+    (limiter or AdaptiveLimit()).call(blob.reload)
+    if blob.crc32c != checksum:
+        raise DataCorruption(None, "Checksum mismatch after uploading {0} to {1}".format(source, blob.name))
+
+class TransferJournal():
+    """
+    A persistent record of the progress of a folder transfer, stored at path.
+    The journal tracks the checksums of objects which were fully transferred and the
+    number of bytes transferred so far for partial objects, so that an interrupted
+    transfer can be resumed by re-running it with the same journal.
+
+    Each update is appended to the file as one JSON line, so the cost of recording progress
+    does not grow with the number of objects. The log is compacted to one line per object
+    whenever a journal is loaded. A line left incomplete by an interrupted write is ignored.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.completed = {} # Object name -> base64 CRC32C
+        self.partial = {} # Object name -> state of a partial transfer
+        self._lock = threading.RLock() # Transfers may update the journal from several threads.
+        self._log = None
+        if os.path.isfile(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError: # Interrupted while writing this record.
+                        continue
+                    self._replay(record)
+            self.save()
+
+    def save(self):
+        """ Atomically rewrites the journal with one record per object, compacting the log. """
+        with self._lock:
+            temp_path = "{0}.tmp".format(self.path)
+            with open(temp_path, 'w') as f:
+                for name, crc in self.completed.items():
+                    f.write(json.dumps({'name': name, 'completed': crc}) + '\n')
+                for name, state in self.partial.items():
+                    f.write(json.dumps({'name': name, 'partial': state}) + '\n')
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            os.replace(temp_path, self.path)
+
+    def close(self):
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def is_complete(self, name: str, crc: str) -> bool:
+        return crc is not None and self.completed.get(name) == crc
+
+    def mark_complete(self, name: str, crc: str):
+        self._record({'name': name, 'completed': crc})
+
+    def update_partial(self, name: str, **state):
+        with self._lock:
+            self._record({'name': name, 'partial': dict(self.partial.get(name, {}), **state)})
+
+    def discard(self, name: str):
+        """ Forgets all progress for an object so that it is transferred from scratch. """
+        self._record({'name': name, 'discarded': True})
+
+    def _record(self, record: dict):
+        """ Applies an update and appends it to the log. """
+        with self._lock:
+            self._replay(record)
+            if self._log is None:
+                self._log = open(self.path, 'a')
+            self._log.write(json.dumps(record) + '\n')
+            self._log.flush()
+
+    def _replay(self, record: dict):
+        name = record['name']
+        self.completed.pop(name, None)
+        self.partial.pop(name, None)
+        if 'completed' in record:
+            self.completed[name] = record['completed']
+        elif 'partial' in record:
+            self.partial[name] = record['partial']
+
 def upload_all(
     path: str,
     bucket_name: str, 
@@ -46,7 +251,11 @@ def upload_all(
     verbose: bool = True, 
     replace: bool = True, 
     use_filepaths: bool = True,
-    storage_client = None
+    storage_client = None,
+    journal_path: str = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_workers: int = 16,
+    limiter: AdaptiveLimit = None,
     ):
     """ 
     This uploads all files under the given path. If path is a directory, this function will
@@ -59,8 +268,17 @@ def upload_all(
         folder_name: Name of folder to upload under
         verbose (default True): Whether or not to print info about upload.
         replace (default True): If False, then all files that already exist in the bucket will not be uploaded.
+        journal_path (default None): If provided, progress is recorded in a TransferJournal at this path
+            and files are sent in chunk_size pieces using resumable upload sessions. Re-running an interrupted
+            upload with the same journal only uploads the missing data.
+        max_workers (default 16): Maximum number of files to upload in parallel.
+        limiter (default None): AdaptiveLimit which adjusts the number of requests in flight within max_workers.
+            A new one is created if not provided.
     """
     storage_client = storage_client or get_storage_client()
+    journal = TransferJournal(journal_path) if journal_path else None
+    limiter = limiter or AdaptiveLimit(maximum=max_workers)
+    uploads = [] # (blob, filename) pairs
     # Get bucket and blob from client
     bucket = storage_client.get_bucket(bucket_name)
     depth = len(path.split('/'))
@@ -71,7 +289,7 @@ def upload_all(
             blob = bucket.blob(os.path.join(folder_name, stripped_path)) 
         else:
             blob = bucket.blob(folder_name)
-        blob.upload_from_filename(path)
+        uploads.append((blob, path))
     elif os.path.isdir(path):
         # Traverse folder and upload files
         for r, d, f in os.walk(path):
@@ -88,12 +306,156 @@ def upload_all(
                     if blob is not None and blob.exists(): # Blob already exists
                         print("Skipping {0}".format(relative_filename))
                         continue
-                blob.upload_from_filename(full_filename)
+                uploads.append((blob, full_filename))
     else:
         raise ValueError("The provided path does not point to a file or directory: {0}".format(path))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for _ in executor.map(
+            lambda upload: _upload_file(*upload, journal, chunk_size, storage_client, limiter=limiter),
+            uploads,
+            ):
+            pass
+    if journal is not None:
+        journal.close()
 
     printv("Uploaded all files in {0} for bucket {1} under folder {2}".format(path, bucket_name, folder_name))
 
+def _upload_file(
+    blob, filename: str, journal: TransferJournal, chunk_size: int, storage_client, retries: int = 1,
+    limiter: AdaptiveLimit = None,
+    ):
+    """
+    Uploads a file to blob, with each request made through limiter, and compares the
+    checksum of the uploaded object with that of the file. If a journal is provided, the
+    upload is resumable and the checksum is computed while the file is being sent;
+    otherwise it is computed before sending, and only if google-crc32c is installed. On
+    a mismatch, the upload is restarted up to retries times.
+    """
+    limiter = limiter or AdaptiveLimit()
+    if journal is None:
+        crc = file_crc32c(filename) if crc32c_installed else None
+        limiter.call(blob.upload_from_filename, filename, size=os.path.getsize(filename))
+        if crc is not None:
+            try:
+                verify_upload(blob, crc, filename, limiter)
+            except DataCorruption:
+                if retries <= 0:
+                    raise
+                print("Checksum mismatch for {0}, retrying upload".format(blob.name))
+                return _upload_file(blob, filename, journal, chunk_size, storage_client, retries=retries-1, limiter=limiter)
+        return
+    if blob.name in journal.completed and journal.is_complete(blob.name, file_crc32c(filename)):
+        return
+    if os.path.getsize(filename) == 0:
+        limiter.call(blob.upload_from_filename, filename)
+        crc = encode_crc32c(0)
+    else:
+        crc = _upload_file_resumable(blob, filename, journal, chunk_size, storage_client, limiter)
+    blob.reload()
+    if blob.crc32c != crc:
+        journal.discard(blob.name)
+        if retries <= 0:
+            raise DataCorruption(None, "Checksum mismatch after uploading {0} to {1}".format(filename, blob.name))
+        print("Checksum mismatch for {0}, retrying upload".format(blob.name))
+        return _upload_file(blob, filename, journal, chunk_size, storage_client, retries=retries-1, limiter=limiter)
+    journal.mark_complete(blob.name, crc)
+
+def _upload_file_resumable(blob, filename, journal, chunk_size, storage_client, limiter, retries: int = 3) -> str:
+    """
+    Uploads a file in chunks using a resumable upload session which is recorded in the
+    journal, continuing from the last byte committed by the server if a session exists.
+    If sending a chunk fails with a transient error, the committed offset is queried
+    again and sending resumes from there, up to retries times per chunk. A new session
+    is only started if the server no longer knows the current one. The checksum of the
+    sent data is accumulated as it is read and stored in the journal alongside the
+    offset. Returns the base64 encoded checksum of the whole file.
+    """
+    transport = storage_client._http
+    stat = os.stat(filename)
+    source = [stat.st_size, stat.st_mtime_ns]
+    size = stat.st_size
+    state = journal.partial.get(blob.name, {})
+    offset = None
+    if state.get('source') == source:
+        offset = limiter.call(_query_upload_session, transport, state['session'], size)
+    if offset is None: # No session for this version of the file, or it expired.
+        session = limiter.call(blob.create_resumable_upload_session, size=size)
+        journal.update_partial(blob.name, session=session, source=source, bytes=0, crc=0)
+        offset = 0
+    state = journal.partial[blob.name]
+    session = state['session']
+    crc, checked = state['crc'], state['bytes']
+    attempt = 0
+    with open(filename, 'rb') as f:
+        while True:
+            # Bring the checksum up to the offset committed by the server, which can be ahead
+            # of the journal if the process stopped between sending a chunk and recording it,
+            # or if a chunk was persisted but its response was lost.
+            if checked > offset:
+                crc, checked = 0, 0
+            f.seek(checked)
+            while checked < offset:
+                data = f.read(min(chunk_size, offset - checked))
+                crc = crc32c(data, crc)
+                checked += len(data)
+            if offset >= size:
+                break
+            chunk = f.read(chunk_size)
+            try:
+                # Not retried by the limiter: after a failure, the committed offset must be queried again.
+                committed = limiter.call(_upload_chunk, transport, session, chunk, offset, size, size=len(chunk), retries=0)
+            except Exception as e:
+                expired = getattr(e, 'code', None) in (404, 410)
+                if attempt == retries or not (expired or is_transient_error(e)):
+                    raise
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+                offset = None if expired else limiter.call(_query_upload_session, transport, session, size)
+                if offset is None: # The session expired, so start over with a new one.
+                    journal.discard(blob.name)
+                    return _upload_file_resumable(blob, filename, journal, chunk_size, storage_client, limiter, retries - attempt)
+                continue
+            attempt = 0
+            crc = crc32c(memoryview(chunk)[:committed - offset], crc)
+            offset = checked = committed
+            journal.update_partial(blob.name, bytes=offset, crc=crc)
+    return encode_crc32c(crc)
+
+def _committed_bytes(response) -> int:
+    """ Parses the number of bytes persisted by a resumable upload session from a 308 response. """
+    committed = response.headers.get('Range')
+    if committed is None:
+        return 0
+    return int(committed.split('-')[-1]) + 1
+
+def _query_upload_session(transport, session: str, size: int) -> int:
+    """
+    Returns the number of bytes persisted by a resumable upload session, or None if the
+    session no longer exists. Other failures raise the google.api_core exception for
+    their status code.
+    """
+    response = transport.put(session, data=b'', headers={'Content-Range': 'bytes */{0}'.format(size)})
+    if response.status_code in (200, 201):
+        return size
+    if response.status_code == 308:
+        return _committed_bytes(response)
+    if response.status_code in (404, 410):
+        return None
+    raise from_http_status(response.status_code, "Querying resumable upload failed: {0}".format(response.text))
+
+def _upload_chunk(transport, session: str, chunk: bytes, offset: int, size: int) -> int:
+    """
+    Sends a chunk of a file starting at offset to a resumable upload session and returns
+    the number of bytes persisted by the server afterwards.
+    """
+    headers = {'Content-Range': 'bytes {0}-{1}/{2}'.format(offset, offset + len(chunk) - 1, size)}
+    response = transport.put(session, data=chunk, headers=headers)
+    if response.status_code in (200, 201):
+        return size
+    if response.status_code == 308:
+        return _committed_bytes(response)
+    raise from_http_status(response.status_code, "Resumable upload failed: {0}".format(response.text))
+
 def upload_string(
     string: str, 
     bucket_name: str,
@@ -129,6 +491,102 @@ def download_file_to_memory(
     else:
         return buffer
 
+DEFAULT_READ_AHEAD = 8 * 1024 * 1024 # Bytes fetched per ranged request by open_file.
+
+class BlobReader(io.RawIOBase):
+    """
+    A read-only, seekable raw stream over a blob which fetches its contents with ranged
+    reads instead of downloading the whole object. This is normally wrapped in an
+    io.BufferedReader (see open_file) which provides read-ahead buffering.
+
+    Reads are pinned to the generation of the blob, so they fail with NotFound once the
+    object is replaced. If follow_appends is set, the object is assumed to only be
+    appended to (as with AppendableBlob), and reads continue from its latest generation,
+    still limited to the size it had when the reader was opened.
+    """
+    def __init__(self, blob, follow_appends: bool = False):
+        if blob.size is None:
+            blob.reload()
+        self.blob = blob
+        self.size = blob.size
+        self.position = 0
+        self.follow_appends = follow_appends
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError("Invalid whence ({0}, should be 0, 1 or 2)".format(whence))
+        if position < 0:
+            raise ValueError("Negative seek position {0}".format(position))
+        self.position = position
+        return self.position
+
+    def _read_range(self, start: int, end: int) -> bytes:
+        """ Downloads the bytes in [start, end) of the blob. """
+        try:
+            return self.blob.download_as_string(start=start, end=end - 1)
+        except NotFound:
+            if not self.follow_appends:
+                raise
+            blob = self.blob.bucket.get_blob(self.blob.name)
+            if blob is None or blob.size < self.size:
+                raise
+            self.blob = blob
+            return self.blob.download_as_string(start=start, end=end - 1)
+
+    def readinto(self, b) -> int:
+        if self.position >= self.size or len(b) == 0:
+            return 0
+        end = min(self.position + len(b), self.size)
+        data = self._read_range(self.position, end)
+        n = len(data)
+        b[:n] = data
+        self.position += n
+        return n
+
+    def readall(self) -> bytes:
+        if self.position >= self.size:
+            return b''
+        data = self._read_range(self.position, self.size)
+        self.position += len(data)
+        return data
+
+def open_file(
+    bucket_name: str,
+    file_name: str,
+    buffer_size: int = DEFAULT_READ_AHEAD,
+    storage_client = None,
+    ) -> io.BufferedReader:
+    """
+    Opens a file hosted in a bucket as a read-only, seekable binary file object. Data is
+    fetched lazily using ranged reads of buffer_size bytes, so files larger than memory
+    can be consumed incrementally. If buffer_size is 0, the unbuffered BlobReader is
+    returned, which fetches exactly the bytes requested by each read. Reads fail with
+    NotFound if the object is replaced while the file is open.
+    """
+    storage_client = storage_client or get_storage_client()
+    bucket = storage_client.get_bucket(bucket_name)
+    blob = bucket.get_blob(file_name)
+    if blob is None:
+        raise ValueError("Could not find file gs://{0}/{1}".format(bucket_name, file_name))
+    if buffer_size == 0:
+        return BlobReader(blob)
+    return io.BufferedReader(BlobReader(blob), buffer_size=buffer_size)
+
 def download_file_to_path(
     bucket_name: str, 
     file_name: str, 
@@ -150,6 +608,8 @@ def _make_parent_dirs(filename: str):
                 try:
                     print(subpath)
                     os.mkdir(subpath)
+                except FileExistsError: # Created concurrently by another download.
+                    pass
                 except IOError:
                     raise IOError("Could not create subdirectory {0} when downloading file {1}. Make sure you have the right permissions.".format(subpath, filename))
                     
@@ -162,12 +622,24 @@ def download_folder_to_path(
     storage_client = None,
     flatten=False,
     asynchronous=False,
+    journal_path: str = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_workers: int = 16,
+    limiter: AdaptiveLimit = None,
     ):
     """ 
     Downloads a folder hosted in a bucket to the chosen path.
     If flatten is set to True, then the hierarchy structure of the cloud folder
     is ignored and all files are downloaded to a single directory.
+    If journal_path is provided, progress is recorded in a TransferJournal at that path
+    and files are downloaded in chunk_size ranges, so that re-running an interrupted
+    download only fetches the missing data. Each file's checksum is verified.
+    Files are downloaded concurrently, using up to max_workers threads (or coroutines if
+    asynchronous is set). The number of requests in flight is adjusted within that bound
+    by limiter, which defaults to a new AdaptiveLimit.
     """
+    if journal_path and asynchronous:
+        raise ValueError("Journaled downloads are not supported in asynchronous mode.")
 
     storage_client = storage_client or get_storage_client()
     bucket = storage_client.get_bucket(bucket_name)
@@ -183,14 +655,33 @@ def download_folder_to_path(
         sublength = len(folder.split("/"))
     if asynchronous:
         loop = asyncio.get_event_loop()
-        loop.run_until_complete(_download_blobs_async(blobs, flatten, sublength, path))
+        loop.run_until_complete(_download_blobs_async(blobs, flatten, sublength, path, max_concurrency=max_workers, limiter=limiter))
     else:
-        _download_blobs(blobs, flatten, sublength, path, storage_client)
+        journal = TransferJournal(journal_path) if journal_path else None
+        _download_blobs(
+            blobs, flatten, sublength, path, storage_client,
+            journal=journal, chunk_size=chunk_size, max_workers=max_workers, limiter=limiter,
+        )
+        if journal is not None:
+            journal.close()
 
-def _download_blobs(blobs, flatten, sublength, path, storage_client=None):
+def _download_blobs(
+    blobs, flatten, sublength, path, storage_client=None, journal=None, chunk_size=DEFAULT_CHUNK_SIZE, retries=1,
+    max_workers=16, limiter=None,
+    ):
 
     storage_client = storage_client or get_storage_client()
-    for blob in tqdm(blobs):
+    limiter = limiter or AdaptiveLimit(maximum=max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        downloads = executor.map(
+            lambda blob: _download_blob(blob, flatten, sublength, path, storage_client, journal, chunk_size, retries, limiter),
+            blobs,
+        )
+        for _ in tqdm(downloads, total=len(blobs)):
+            pass
+
+def _download_blob(blob, flatten, sublength, path, storage_client, journal, chunk_size, retries, limiter):
+
         if flatten:
             filename = blob.name.split('/')[-1]
         else:
@@ -200,13 +691,72 @@ def _download_blobs(blobs, flatten, sublength, path, storage_client=None):
 
         full_filename = os.path.join(path, filename)
         _make_parent_dirs(full_filename)
+        if journal is not None:
+            _download_blob_resumable(blob, full_filename, journal, chunk_size, storage_client, retries=retries, limiter=limiter)
+            return
+        print("Downloading {0} to {1}".format(blob.name, full_filename))
+        verify = should_verify(blob)
         with open(os.path.join(full_filename), 'wb') as f:
-            print("Downloading {0} to {1}".format(blob.name, full_filename))
-            try:
-                storage_client.download_blob_to_file(blob, f)         
-            except DataCorruption: # Sometimes there is an error with the MD5 hash, so retry.
-                storage_client.download_blob_to_file(blob, f)
+            for attempt in range(retries + 1):
+                f.seek(0)
+                f.truncate()
+                writer = Crc32cWriter(f) if verify else f
+                try:
+                    limiter.call(storage_client.download_blob_to_file, blob, writer, size=blob.size or 0, retries=0)
+                except Exception as e: # DataCorruption is raised when there is an error with the MD5 hash.
+                    if attempt == retries or not (is_transient_error(e) or isinstance(e, DataCorruption)):
+                        raise
+                    time.sleep(backoff_delay(attempt))
+                    continue
+                if not verify or writer.checksum == blob.crc32c:
+                    break
+                print("Checksum mismatch for {0}, retrying download".format(blob.name))
+            else:
+                raise DataCorruption(None, "Checksum mismatch after downloading {0} to {1}".format(blob.name, full_filename))
+
+def _download_blob_resumable(blob, filename, journal, chunk_size, storage_client, retries=1, limiter=None):
+    """
+    Downloads a blob to filename in chunk_size ranges, recording progress in the journal.
+    Skips blobs which the journal records as complete and resumes partial downloads of
+    the same object generation. The checksum is accumulated as data is written and kept
+    in the journal with the offset, and the download is restarted from scratch up to
+    retries times if it does not match the object metadata.
+    """
+    if journal.is_complete(blob.name, blob.crc32c) and os.path.isfile(filename):
+        print("Skipping {0}, already downloaded".format(blob.name))
+        return
+    state = journal.partial.get(blob.name, {})
+    offset, crc = 0, 0
+    if state.get('generation') == blob.generation and os.path.isfile(filename) \
+        and os.path.getsize(filename) >= state['bytes']:
+        offset, crc = state['bytes'], state['crc']
+    print("Downloading {0} to {1} from byte {2}".format(blob.name, filename, offset))
+    limiter = limiter or AdaptiveLimit()
+    with open(filename, 'r+b' if offset else 'wb') as f:
+        writer = Crc32cWriter(f, crc)
 
+        def download_range(start, end):
+            # Discards anything written by a failed attempt before (re)trying.
+            f.seek(start)
+            f.truncate()
+            writer.crc = crc
+            storage_client.download_blob_to_file(blob, writer, start=start, end=end - 1)
+
+        while offset < blob.size:
+            end = min(offset + chunk_size, blob.size)
+            limiter.call(download_range, offset, end, size=end - offset, retries=retries)
+            f.flush()
+            offset, crc = f.tell(), writer.crc
+            journal.update_partial(blob.name, bytes=offset, crc=crc, generation=blob.generation)
+        f.truncate()
+    if should_verify(blob, require_fast=False) and writer.checksum != blob.crc32c:
+        journal.discard(blob.name)
+        if retries <= 0:
+            raise DataCorruption(None, "Checksum mismatch after downloading {0} to {1}".format(blob.name, filename))
+        print("Checksum mismatch for {0}, retrying download".format(blob.name))
+        _download_blob_resumable(blob, filename, journal, chunk_size, storage_client, retries=retries-1, limiter=limiter)
+        return
+    journal.mark_complete(blob.name, blob.crc32c)
 
 def grouper_it(n, iterable):
     it = iter(iterable)
@@ -218,12 +768,9 @@ def grouper_it(n, iterable):
             return
         yield itertools.chain((first_el,), chunk_it)
 
-async def _download_blobs_async(blobs, flatten, sublength, path, max_concurrency=10, chunk_size=20):
+async def _download_blobs_async(blobs, flatten, sublength, path, max_concurrency=64, chunk_size=20, limiter=None):
 
-    #max_queue = min(max_queue, len(blobs))
-    max_queue = len(blobs)
-    max_concurrency = min(max_concurrency, max_queue)
-    semaphore = asyncio.Semaphore(max_concurrency)
+    limiter = limiter or AdaptiveLimit(maximum=max_concurrency)
     async with aiohttp.ClientSession() as session:
         storage_client = Storage(session=session)
         progress = tqdm(total=len(blobs))
@@ -231,14 +778,13 @@ async def _download_blobs_async(blobs, flatten, sublength, path, max_concurrency
         for group in grouper_it(num_chunks, blobs):
             tasks = []
             for blob in group:
-                tasks.append(_download_blob_async(blob, semaphore, flatten, sublength, path, storage_client))
-            for task in tqdm(tasks):
+                tasks.append(_download_blob_async(blob, limiter, flatten, sublength, path, storage_client))
+            for task in asyncio.as_completed(tasks):
                 await task
                 progress.update(1)
             
-async def _download_blob_async(blob, semaphore, flatten, sublength, path, storage_client):
+async def _download_blob_async(blob, limiter, flatten, sublength, path, storage_client, retries=1, write_size=DEFAULT_READ_AHEAD):
 
-        await semaphore.acquire()
         if flatten:
             filename = blob.name.split('/')[-1]
         else:
@@ -249,17 +795,199 @@ async def _download_blob_async(blob, semaphore, flatten, sublength, path, storag
         full_filename = os.path.join(path, filename)
         _make_parent_dirs(full_filename)
         print("Downloading {0} to {1}".format(blob.name, full_filename))
-        try:
-            response = await storage_client.download(blob.bucket.name, blob.name, timeout=20000000)
-        except:
-            response = await storage_client.download(blob.bucket.name, blob.name, timeout=20000000)
-        async with aiofiles.open(os.path.join(full_filename), "wb") as af:
-            await af.write(response)    
-            print("Downloaded {0} to {1}".format(blob.name, full_filename))
-        semaphore.release()
+        verify = should_verify(blob)
+        for attempt in range(retries + 1):
+            response = await limiter.call_async(
+                storage_client.download, blob.bucket.name, blob.name, timeout=20000000,
+                size=blob.size or 0, retries=retries,
+            )
+            crc = 0
+            async with aiofiles.open(os.path.join(full_filename), "wb") as af:
+                for start in range(0, len(response), write_size):
+                    chunk = memoryview(response)[start:start + write_size]
+                    if verify:
+                        crc = crc32c(chunk, crc)
+                    await af.write(chunk)
+            if not verify or encode_crc32c(crc) == blob.crc32c:
+                print("Downloaded {0} to {1}".format(blob.name, full_filename))
+                break
+            print("Checksum mismatch for {0}, retrying download".format(blob.name))
+        else:
+            raise DataCorruption(None, "Checksum mismatch after downloading {0} to {1}".format(blob.name, full_filename))
 
         return True
 
+def rewrite_blob(source_blob, destination_blob, limiter: AdaptiveLimit = None):
+    """
+    Copies source_blob to destination_blob server-side using the rewrite API. Large
+    objects may take several rewrite calls, which are continued using the returned token.
+    Each call is made through limiter, which retries it if it fails.
+    """
+    limiter = limiter or AdaptiveLimit()
+    token, _, _ = limiter.call(destination_blob.rewrite, source_blob)
+    while token is not None:
+        token, _, _ = limiter.call(destination_blob.rewrite, source_blob, token=token)
+
+def copy_blobs(
+    source_bucket_name: str,
+    source_names: List[str],
+    destination_bucket_name: str,
+    destination_names: List[str],
+    max_workers: int = 8,
+    storage_client = None,
+    limiter: AdaptiveLimit = None,
+    ):
+    """
+    Copies the files at source_names to destination_names without passing their
+    contents through this machine. Copies are performed in parallel using up to
+    max_workers threads, and the number of requests in flight is adjusted within that
+    bound by limiter, which defaults to a new AdaptiveLimit.
+    """
+    limiter = limiter or AdaptiveLimit(maximum=max_workers)
+    storage_client = storage_client or get_storage_client()
+    source_bucket = storage_client.get_bucket(source_bucket_name)
+    destination_bucket = storage_client.get_bucket(destination_bucket_name)
+    pairs = [
+        (source_bucket.blob(source_name), destination_bucket.blob(destination_name))
+        for source_name, destination_name in zip(source_names, destination_names)
+    ]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for _ in executor.map(lambda pair: rewrite_blob(*pair, limiter=limiter), pairs):
+            pass
+
+class AppendableBlob():
+    """
+    An object in a bucket which can be appended to at a cost proportional to the appended
+    data rather than to the size of the object. Each append uploads a small chunk object
+    under {staging_prefix}{name}.chunks/, and once compact_every chunks are pending they
+    are merged into the main object with server-side compose. Readers of the main object
+    always see a consistent committed prefix of the appended data. Chunks are staged
+    outside the folder of the main object, so they are not listed as part of a coffer.
+
+    GCS limits composite objects to 1024 components. Before a merge would take the main
+    object past max_components, it is re-uploaded as a regular object first. This passes
+    the whole object through this machine, but happens at most once per max_components
+    merged chunks, so its cost amortizes to the object's size divided by max_components
+    per chunk.
+
+    The name of the last merged chunk is stored in the metadata of the main object, so a
+    writer which is restarted picks up pending chunks without merging any of them twice.
+    Only one writer should append to an object at a time.
+    """
+    max_compose_sources = 32 # Limit on the number of sources in one compose request.
+    chunk_metadata_key = 'caboodle-last-chunk'
+    staging_prefix = '.caboodle-staging/'
+
+    def __init__(
+        self,
+        bucket_name: str,
+        name: str,
+        compact_every: int = 16,
+        max_components: int = 1024,
+        storage_client = None,
+        ):
+        storage_client = storage_client or get_storage_client()
+        self.bucket = storage_client.get_bucket(bucket_name)
+        self.name = name
+        self.compact_every = compact_every
+        self.max_components = max_components
+        self.chunk_prefix = "{0}{1}.chunks/".format(self.staging_prefix, name)
+        self.merged_prefix = "{0}{1}.merged/".format(self.staging_prefix, name)
+        self._recover()
+
+    def _recover(self):
+        """
+        Finds chunks which were appended but not yet merged, and deletes chunks and
+        intermediate objects left behind by an interrupted commit.
+        """
+        main = self.bucket.get_blob(self.name)
+        self.main_exists = main is not None
+        self.component_count = (main.component_count or 1) if main else 0
+        last_chunk = (main.metadata or {}).get(self.chunk_metadata_key, '') if main else ''
+        self.pending = []
+        for blob in self.bucket.list_blobs(prefix=self.chunk_prefix):
+            if blob.name > last_chunk:
+                self.pending.append(blob.name)
+            else:
+                blob.delete()
+        for blob in self.bucket.list_blobs(prefix=self.merged_prefix):
+            blob.delete()
+        self.pending.sort()
+        last = self.pending[-1] if self.pending else last_chunk
+        self.next_sequence = int(last[len(self.chunk_prefix):]) + 1 if last else 0
+
+    def append(self, data: bytes):
+        """
+        Appends data to the object. The data becomes visible to readers once it is
+        committed, which happens automatically every compact_every appends.
+        """
+        chunk_name = "{0}{1:012d}".format(self.chunk_prefix, self.next_sequence)
+        self.bucket.blob(chunk_name).upload_from_string(data)
+        self.next_sequence += 1
+        self.pending.append(chunk_name)
+        if len(self.pending) >= self.compact_every:
+            self.commit()
+
+    def commit(self):
+        """
+        Merges all pending chunks into the main object. Chunks are first composed into
+        intermediate objects if there are too many to merge in a single request.
+        """
+        if not self.pending:
+            return
+        sources = [self.bucket.blob(name) for name in self.pending]
+        intermediates = []
+        while len(sources) > self.max_compose_sources - 1:
+            merged = []
+            for i in range(0, len(sources), self.max_compose_sources):
+                group = sources[i:i + self.max_compose_sources]
+                if len(group) == 1:
+                    merged.append(group[0])
+                    continue
+                target = self.bucket.blob("{0}{1:012d}".format(self.merged_prefix, len(intermediates)))
+                target.compose(group)
+                intermediates.append(target)
+                merged.append(target)
+            sources = merged
+        main = self.bucket.blob(self.name)
+        incoming = sum(source.component_count or 1 for source in sources)
+        if self.main_exists and self.component_count + incoming > self.max_components:
+            self._flatten(main)
+            self.component_count = 1
+        main.metadata = {self.chunk_metadata_key: self.pending[-1]}
+        main.compose(([main] if self.main_exists else []) + sources)
+        self.component_count = main.component_count or self.component_count + incoming
+        self.main_exists = True
+        for blob in intermediates:
+            blob.delete()
+        for name in self.pending:
+            self.bucket.blob(name).delete()
+        self.pending = []
+
+    def _flatten(self, main):
+        """
+        Re-uploads the main object as a regular object to reset its component count. The
+        object is downloaded and uploaded again (see the class docstring for the cost).
+        """
+        source = self.bucket.get_blob(self.name)
+        main.metadata = source.metadata
+        with io.BufferedReader(BlobReader(source), buffer_size=DEFAULT_READ_AHEAD) as f:
+            main.upload_from_file(f, size=source.size)
+
+    def open(self, buffer_size: int = DEFAULT_READ_AHEAD) -> io.BufferedReader:
+        """
+        Opens the contents of the object committed so far as a read-only file object, which
+        is unbuffered if buffer_size is 0. Each commit replaces the main object with a new
+        generation, and the reader follows it (see BlobReader), so it can be read while
+        appends continue.
+        """
+        main = self.bucket.get_blob(self.name)
+        if main is None:
+            return io.BytesIO()
+        if buffer_size == 0:
+            return BlobReader(main, follow_appends=True)
+        return io.BufferedReader(BlobReader(main, follow_appends=True), buffer_size=buffer_size)
+
 def parse_gcs_path(gcs_path:str) -> Tuple[str,str]:
     """ Parses a gcs path string of the form gs://{bucket-name}/{path} into bucket and path components. """
 
@@ -0,0 +1,318 @@
+from caboodle import gcs, artifacts
+from caboodle.concurrency import AdaptiveLimit
+from caboodle.fakes_test import FakeAioStorage, FakeBlob, FakeClient
+from google.api_core.exceptions import BadRequest
+import pickle
+import io
+import os
+import asyncio
+
+def test_BlobReader():
+
+    data = bytes(range(256)) * 100
+    blob = FakeBlob('folder/test.bin', data)
+    f = io.BufferedReader(gcs.BlobReader(blob), buffer_size=1000)
+    assert f.read(10) == data[:10]
+    assert len(blob.requests) == 1
+    assert f.read(10) == data[10:20]
+    assert len(blob.requests) == 1 # Served from the read-ahead buffer
+    f.seek(-5, io.SEEK_END)
+    assert f.read() == data[-5:]
+    f.seek(5000)
+    assert f.tell() == 5000
+    assert f.read(3000) == data[5000:8000]
+    f.seek(0)
+    assert f.read() == data
+    assert f.read() == b''
+
+def test_BlobReader_deserialize():
+
+    p = [1,2,3,4,'hii']
+    blob = FakeBlob('folder/test.pickle', pickle.dumps(p))
+    f = io.BufferedReader(gcs.BlobReader(blob), buffer_size=4)
+    art = artifacts.PickleArtifact('test.pickle')
+    assert art.deserialize(f) == p
+
+def test_copy_blobs():
+
+    client = FakeClient()
+    bucket = client.get_bucket('source')
+    FakeBlob('a/small', b'tiny', bucket=bucket)
+    FakeBlob('a/large', b'x'*100, bucket=bucket)
+    gcs.copy_blobs('source', ['a/small', 'a/large'], 'dest', ['b/small', 'b/large'], storage_client=client)
+    dest = client.get_bucket('dest')
+    assert dest.get_blob('b/small').data == b'tiny'
+    assert dest.get_blob('b/large').data == b'x'*100
+
+def test_crc32c():
+
+    data = bytes(range(256)) * 10
+    assert gcs.crc32c(b'123456789') == 0xE3069283
+    assert gcs.crc32c(data[100:], gcs.crc32c(data[:100])) == gcs.crc32c(data)
+    if gcs.crc32c_installed:
+        gcs.crc32c_installed = False
+        try:
+            assert gcs.crc32c(data[100:], gcs.crc32c(data[:100])) == gcs.crc32c(data)
+            assert gcs.crc32c(b'123456789') == 0xE3069283
+        finally:
+            gcs.crc32c_installed = True
+
+def test_download_folder_journal(tmpdir):
+
+    client = FakeClient()
+    bucket = client.get_bucket('bucket')
+    files = {'a': bytes(range(256)) * 4, 'b': b'b' * 100, 'c': b''}
+    for name, data in files.items():
+        FakeBlob('folder/{0}'.format(name), data, bucket=bucket)
+    path = str(tmpdir.mkdir('out'))
+    journal_path = str(tmpdir.join('journal.json'))
+    client.fail_after = 3
+    try:
+        gcs.download_folder_to_path(
+            'bucket', 'folder', path, storage_client=client, journal_path=journal_path, chunk_size=300, max_workers=1,
+        )
+        assert False
+    except ConnectionError:
+        pass
+    journal = gcs.TransferJournal(journal_path)
+    assert journal.partial['folder/a']['bytes'] == 900
+    client.fail_after = None
+    bucket.blobs['folder/b'].requests = []
+    gcs.download_folder_to_path('bucket', 'folder', path, storage_client=client, journal_path=journal_path, chunk_size=300)
+    assert bucket.blobs['folder/a'].requests[-1] == (900, 1023) # Resumed where it left off
+    for name, data in files.items():
+        with open(os.path.join(path, name), 'rb') as f:
+            assert f.read() == data
+    journal = gcs.TransferJournal(journal_path)
+    assert set(journal.completed) == {'folder/a', 'folder/b', 'folder/c'}
+    assert journal.partial == {}
+    bucket.blobs['folder/b'].requests = []
+    gcs.download_folder_to_path('bucket', 'folder', path, storage_client=client, journal_path=journal_path, chunk_size=300)
+    assert bucket.blobs['folder/b'].requests == [] # Already complete
+
+def test_TransferJournal(tmpdir):
+
+    path = str(tmpdir.join('journal'))
+    journal = gcs.TransferJournal(path)
+    for i in range(5):
+        journal.update_partial('a', bytes=i, crc=0)
+    journal.mark_complete('b', 'crc')
+    journal.update_partial('c', bytes=1)
+    journal.discard('c')
+    journal.close()
+    with open(path) as f:
+        assert len(f.readlines()) == 8 # One appended record per update
+    with open(path, 'a') as f:
+        f.write('{"name": "d", "comp') # Interrupted write
+    journal = gcs.TransferJournal(path)
+    assert journal.partial == {'a': {'bytes': 4, 'crc': 0}}
+    assert journal.completed == {'b': 'crc'}
+    with open(path) as f:
+        assert len(f.readlines()) == 2 # Compacted on load
+    journal.close()
+
+def test_upload_all_journal(tmpdir):
+
+    client = FakeClient()
+    folder = tmpdir.mkdir('upload')
+    folder.join('a').write_binary(b'a' * 1000)
+    folder.join('b').write_binary(b'b' * 10)
+    journal_path = str(tmpdir.join('journal.json'))
+    client._http.persist_limit = 300 # Server only commits part of each chunk
+    gcs.upload_all(str(folder), 'bucket', 'dest', storage_client=client, journal_path=journal_path, chunk_size=400, verbose=False)
+    bucket = client.get_bucket('bucket')
+    assert bucket.get_blob('dest/upload/a').data == b'a' * 1000
+    assert bucket.get_blob('dest/upload/b').data == b'b' * 10
+    journal = gcs.TransferJournal(journal_path)
+    assert set(journal.completed) == {'dest/upload/a', 'dest/upload/b'}
+    # Resuming a partially uploaded session only sends the missing bytes.
+    folder.join('a').write_binary(b'c' * 1000)
+    session = bucket.blob('dest/upload/a').create_resumable_upload_session(size=1000)
+    client._http.persist_limit = None
+    client._http.put(session, data=b'c' * 512, headers={'Content-Range': 'bytes 0-511/1000'})
+    stat = os.stat(str(folder.join('a')))
+    # The journal lags behind the session, as if the process stopped before recording the chunk.
+    journal.update_partial('dest/upload/a', session=session, source=[stat.st_size, stat.st_mtime_ns], bytes=0, crc=0)
+    client._http.requests = []
+    gcs.upload_all(str(folder), 'bucket', 'dest', storage_client=client, journal_path=journal_path, chunk_size=1024, verbose=False)
+    assert bucket.get_blob('dest/upload/a').data == b'c' * 1000
+    assert client._http.requests == [(session, 'bytes */1000'), (session, 'bytes 512-999/1000')]
+
+def test_upload_resumable_retry(tmpdir):
+
+    client = FakeClient()
+    bucket = client.get_bucket('bucket')
+    folder = tmpdir.mkdir('upload')
+    folder.join('a').write_binary(b'a' * 1000)
+    journal_path = str(tmpdir.join('journal.json'))
+    # A throttled chunk is resent from the offset the server reports.
+    client._http.failures = [503]
+    gcs.upload_all(str(folder), 'bucket', 'dest', storage_client=client, journal_path=journal_path, chunk_size=400, verbose=False)
+    assert bucket.get_blob('dest/upload/a').data == b'a' * 1000
+    assert client._http.requests[:3] == [('session-0', 'bytes 0-399/1000'), ('session-0', 'bytes */1000'), ('session-0', 'bytes 0-399/1000')]
+    # An expired session is replaced with a new one.
+    folder.join('a').write_binary(b'b' * 1000)
+    client._http.requests = []
+    client._http.failures = [503, 404]
+    gcs.upload_all(str(folder), 'bucket', 'dest', storage_client=client, journal_path=journal_path, chunk_size=400, verbose=False)
+    assert bucket.get_blob('dest/upload/a').data == b'b' * 1000
+    assert client._http.requests[:3] == [('session-1', 'bytes 0-399/1000'), ('session-1', 'bytes */1000'), ('session-2', 'bytes 0-399/1000')]
+    # Other errors are not retried.
+    folder.join('a').write_binary(b'c' * 1000)
+    client._http.failures = [400]
+    try:
+        gcs.upload_all(str(folder), 'bucket', 'dest', storage_client=client, journal_path=journal_path, chunk_size=400, verbose=False)
+        assert False
+    except BadRequest:
+        pass
+
+def test_Crc32cWriter():
+
+    data = bytes(range(256)) * 10
+    buffer = io.BytesIO()
+    writer = gcs.Crc32cWriter(buffer)
+    writer.write(data[:1000])
+    writer.write(data[1000:])
+    assert buffer.getvalue() == data
+    assert writer.checksum == gcs.encode_crc32c(gcs.crc32c(data))
+
+def test_Crc32cReader():
+
+    data = bytes(range(256)) * 10
+    reader = gcs.Crc32cReader(io.BytesIO(data))
+    assert reader.read(1000) == data[:1000]
+    reader.seek(500) # Resending part of the data does not count it twice.
+    assert reader.read(1000) == data[500:1500]
+    assert reader.read() == data[1500:]
+    assert reader.checksum == gcs.encode_crc32c(gcs.crc32c(data))
+
+def test_upload_file_checksum(tmpdir):
+
+    client = FakeClient()
+    blob = client.get_bucket('bucket').blob('folder/a')
+    filename = str(tmpdir.join('a'))
+    with open(filename, 'wb') as f:
+        f.write(b'abcdefgh' * 10)
+    client.corrupt_uploads = 1
+    gcs._upload_file(blob, filename, None, gcs.DEFAULT_CHUNK_SIZE, client)
+    assert blob.data == b'abcdefgh' * 10
+    client.corrupt_uploads = 2
+    try:
+        gcs._upload_file(blob, filename, None, gcs.DEFAULT_CHUNK_SIZE, client)
+        assert False
+    except gcs.DataCorruption:
+        pass
+
+def test_download_checksum_retry(tmpdir):
+
+    client = FakeClient()
+    bucket = client.get_bucket('bucket')
+    FakeBlob('folder/a', b'abcdefgh' * 10, bucket=bucket)
+    path = str(tmpdir.mkdir('out'))
+    client.corrupt = 1
+    gcs.download_folder_to_path('bucket', 'folder', path, storage_client=client)
+    assert tmpdir.join('out', 'a').read_binary() == b'abcdefgh' * 10
+    client.corrupt = 2
+    try:
+        gcs.download_folder_to_path('bucket', 'folder', path, storage_client=client)
+        assert False
+    except gcs.DataCorruption:
+        pass
+    client.corrupt = 1
+    journal_path = str(tmpdir.join('journal.json'))
+    gcs.download_folder_to_path('bucket', 'folder', path, storage_client=client, journal_path=journal_path, chunk_size=30)
+    assert tmpdir.join('out', 'a').read_binary() == b'abcdefgh' * 10
+    assert gcs.TransferJournal(journal_path).completed['folder/a'] == bucket.blobs['folder/a'].crc32c
+    bucket.blobs['folder/a'].content_encoding = 'gzip' # Checksum covers the compressed bytes
+    client.corrupt = 2
+    gcs.download_folder_to_path('bucket', 'folder', path, storage_client=client)
+    bucket.blobs['folder/a'].content_encoding = None
+    gcs.crc32c_installed = False
+    try:
+        client.corrupt = 2
+        gcs.download_folder_to_path('bucket', 'folder', path, storage_client=client) # Not verified
+    finally:
+        gcs.crc32c_installed = True
+
+def test_download_blob_async_checksum(tmpdir):
+
+    client = FakeClient()
+    bucket = client.get_bucket('bucket')
+    blob = FakeBlob('folder/a', b'abcdefgh' * 10, bucket=bucket)
+    aio_client = FakeAioStorage(client)
+    aio_client.corrupt = 1
+    path = str(tmpdir)
+    async def download(**kwargs):
+        return await gcs._download_blob_async(blob, AdaptiveLimit(), False, 1, path, aio_client, **kwargs)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(download(write_size=16))
+    assert tmpdir.join('a').read_binary() == b'abcdefgh' * 10
+    aio_client.corrupt = 2
+    try:
+        loop.run_until_complete(download())
+        assert False
+    except gcs.DataCorruption:
+        pass
+    loop.close()
+
+def test_AppendableBlob():
+
+    client = FakeClient()
+    bucket = client.get_bucket('bucket')
+    log = gcs.AppendableBlob('bucket', 'logs/out.log', compact_every=4, storage_client=client)
+    with log.open() as f:
+        assert f.read() == b''
+    for i in range(6):
+        log.append('{0}\n'.format(i).encode())
+    assert bucket.get_blob('logs/out.log').data == b'0\n1\n2\n3\n' # Committed prefix
+    assert len(log.pending) == 2
+    # A restarted writer picks up the pending chunks.
+    log = gcs.AppendableBlob('bucket', 'logs/out.log', compact_every=100, storage_client=client)
+    assert len(log.pending) == 2
+    for i in range(6, 80):
+        log.append('{0}\n'.format(i).encode())
+    log.commit()
+    expected = b''.join('{0}\n'.format(i).encode() for i in range(80))
+    with log.open(buffer_size=16) as f:
+        assert f.read() == expected
+    assert [name for name in bucket.blobs if name != 'logs/out.log'] == []
+    # Chunks merged before an interrupted commit could delete them are not merged again.
+    log.append(b'80\n')
+    log.commit()
+    FakeBlob(log.chunk_prefix + '000000000080', b'80\n', bucket=bucket)
+    log = gcs.AppendableBlob('bucket', 'logs/out.log', storage_client=client)
+    assert log.pending == []
+    assert bucket.get_blob('logs/out.log').data == expected + b'80\n'
+    # The main object is flattened once it has too many components.
+    FakeBlob.component_limit = 5
+    try:
+        log = gcs.AppendableBlob('bucket', 'logs/out.log', compact_every=1, max_components=5, storage_client=client)
+        for i in range(81, 90):
+            log.append('{0}\n'.format(i).encode())
+            assert bucket.get_blob('logs/out.log').component_count in (2, 3, 4, 5)
+    finally:
+        FakeBlob.component_limit = 1024
+    assert bucket.get_blob('logs/out.log').data == b''.join('{0}\n'.format(i).encode() for i in range(90))
+    assert bucket.get_blob('logs/out.log').metadata[log.chunk_metadata_key] == log.chunk_prefix + '000000000089'
+
+def test_AppendableBlob_generations():
+
+    client = FakeClient()
+    bucket = client.get_bucket('bucket')
+    bucket.pin_generations = True
+    log = gcs.AppendableBlob('bucket', 'logs/out.log', compact_every=2, storage_client=client)
+    log.append(b'0\n')
+    log.append(b'1\n')
+    f = log.open(buffer_size=0)
+    plain = gcs.open_file('bucket', 'logs/out.log', buffer_size=0, storage_client=client)
+    assert f.read(2) == plain.read(2) == b'0\n'
+    log.append(b'2\n')
+    log.append(b'3\n') # Commits a new generation of the object
+    assert f.read() == b'1\n' # Continues from the new generation, up to the size when opened
+    try:
+        plain.read()
+        assert False
+    except gcs.NotFound:
+        pass
+    with log.open() as f:
+        assert f.read() == b'0\n1\n2\n3\n'
@@ -0,0 +1,208 @@
+from caboodle.coffer import Coffer, infer_type
+from caboodle.artifacts import Artifact
+from typing import Type
+import hashlib
+import struct
+import tempfile
+import fcntl
+import io
+import os
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+    shared_memory_supported = True
+except ImportError: # Python < 3.8
+    shared_memory_supported = False
+
+# Each segment starts with a header containing a ready flag, a reference count and the
+# length of the payload which follows it.
+header = struct.Struct('<qqq')
+
+def _open_segment(name: str, create: bool = False, size: int = 0):
+    """
+    Creates or attaches to a shared memory segment whose lifetime is managed by reference
+    counting rather than by the resource tracker of the process which opened it.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    except TypeError: # Python < 3.13 always registers segments with the resource tracker.
+        segment = shared_memory.SharedMemory(name=name, create=create, size=size)
+        resource_tracker.unregister(segment._name, 'shared_memory')
+        return segment
+
+def _unlink_segment(segment):
+    """ Removes a segment opened with _open_segment from the system. """
+    if not getattr(segment, '_track', True):
+        segment.unlink()
+    else: # SharedMemory.unlink unregisters the segment, so register it again first.
+        resource_tracker.register(segment._name, 'shared_memory')
+        segment.unlink()
+
+class MemoryReader(io.RawIOBase):
+    """
+    A read-only, seekable raw stream over a memoryview which does not copy the
+    underlying memory until it is read.
+    """
+    def __init__(self, view: memoryview):
+        self.view = view
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = len(self.view) + offset
+        else:
+            raise ValueError("Invalid whence ({0}, should be 0, 1 or 2)".format(whence))
+        return self.position
+
+    def readinto(self, b) -> int:
+        data = self.view[self.position:self.position + len(b)]
+        n = len(data)
+        b[:n] = data
+        self.position += n
+        return n
+
+class SharedArtifactCache():
+    """
+    A node-local cache of the raw bytes of artifacts in a coffer, shared between processes
+    using multiprocessing.shared_memory. The first process to request an artifact fetches
+    it from the coffer and publishes it in a shared memory segment; other processes on the
+    same node attach to that segment instead of fetching their own copy.
+
+    Segments are reference counted across processes. Each process should call release (or
+    close) when it no longer needs an artifact, and the segment is removed once no process
+    holds it. Segments held by processes which exit without releasing them are not removed.
+    """
+    def __init__(self, coffer: Coffer, namespace: str = None, lock_dir: str = None):
+        if not shared_memory_supported:
+            raise ModuleNotFoundError("SharedArtifactCache requires multiprocessing.shared_memory (Python 3.8+).")
+        self.coffer = coffer
+        self.namespace = namespace or coffer.location
+        self.lock_dir = lock_dir or os.path.join(tempfile.gettempdir(), 'caboodle-shared-locks')
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self._segments = {} # Key -> SharedMemory held by this process
+
+    def segment_name(self, key: str) -> str:
+        """ Returns the name of the shared memory segment for a key. """
+        digest = hashlib.sha1("{0}/{1}".format(self.namespace, key).encode('utf-8')).hexdigest()
+        return "caboodle-{0}".format(digest[:20])
+
+    def get_buffer(self, key: str) -> memoryview:
+        """
+        Returns a read-only memoryview of the serialized contents of an artifact, backed by
+        shared memory. The artifact is fetched from the coffer if no process on this node
+        has published it yet.
+        """
+        if key not in self._segments:
+            name = self.segment_name(key)
+            with _FileLock(os.path.join(self.lock_dir, "{0}.lock".format(name))):
+                segment = self._attach(name)
+                if segment is None:
+                    segment = self._publish(name, key)
+                ready, refcount, length = header.unpack_from(segment.buf)
+                header.pack_into(segment.buf, 0, ready, refcount + 1, length)
+            self._segments[key] = segment
+        segment = self._segments[key]
+        _, _, length = header.unpack_from(segment.buf)
+        return segment.buf[header.size:header.size + length].toreadonly()
+
+    def get(self, key: str) -> Type[Artifact]:
+        """
+        Returns the deserialized artifact with the given key, reading its serialized
+        contents from shared memory.
+        """
+        artifact_type = infer_type(key)
+        reader = io.BufferedReader(MemoryReader(self.get_buffer(key)))
+        return artifact_type(key, artifact_type(key).deserialize(reader))
+
+    def release(self, key: str):
+        """
+        Releases this process's reference to an artifact. The shared memory segment is
+        removed when no process holds a reference to it. Any memoryviews returned by
+        get_buffer for this key must no longer be used.
+        """
+        segment = self._segments.pop(key, None)
+        if segment is None:
+            return
+        with _FileLock(os.path.join(self.lock_dir, "{0}.lock".format(segment.name))):
+            ready, refcount, length = header.unpack_from(segment.buf)
+            header.pack_into(segment.buf, 0, ready, refcount - 1, length)
+            try:
+                segment.close()
+            except BufferError:
+                pass # A memoryview of the segment is still alive; it is closed when collected.
+            if refcount <= 1:
+                _unlink_segment(segment)
+
+    def close(self):
+        """ Releases all artifacts held by this process. """
+        for key in list(self._segments):
+            self.release(key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _attach(self, name: str):
+        """
+        Attaches to an existing, fully written segment. Segments left incomplete by a
+        process which failed while publishing are removed.
+        """
+        try:
+            segment = _open_segment(name)
+        except FileNotFoundError:
+            return None
+        ready, _, _ = header.unpack_from(segment.buf)
+        if not ready:
+            _unlink_segment(segment)
+            segment.close()
+            return None
+        return segment
+
+    def _publish(self, name: str, key: str):
+        """ Fetches an artifact from the coffer into a new segment. """
+        with self.coffer.open(key) as f:
+            length = f.seek(0, io.SEEK_END)
+            f.seek(0)
+            segment = _open_segment(name, create=True, size=header.size + max(length, 1))
+            header.pack_into(segment.buf, 0, 0, 0, length)
+            view = segment.buf[header.size:header.size + length]
+            filled = 0
+            while filled < length:
+                n = f.readinto(view[filled:])
+                if not n:
+                    raise ValueError("Artifact {0} ended before all of its data was read.".format(key))
+                filled += n
+            view.release()
+        header.pack_into(segment.buf, 0, 1, 0, length)
+        return segment
+
+class _FileLock():
+    """
+    An exclusive inter-process lock on a file, used as a context manager.
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+    def __enter__(self):
+        self.f = open(self.path, 'a')
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
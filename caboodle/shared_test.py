@@ -0,0 +1,56 @@
+from caboodle import artifacts, coffer, shared
+import multiprocessing
+import uuid
+
+class CountingCoffer(coffer.DebugCoffer):
+    """
+    A DebugCoffer which counts how many times artifacts are fetched from it.
+    """
+    def __init__(self):
+        super().__init__()
+        self.fetches = 0
+
+    @property
+    def location(self):
+        return "In Memory {0}".format(id(self))
+
+    def open(self, key):
+        self.fetches += 1
+        return super().open(key)
+
+def attach_in_subprocess(namespace, key, queue):
+    cache = shared.SharedArtifactCache(CountingCoffer(), namespace=namespace)
+    queue.put(cache.get(key).data)
+    cache.close()
+
+def test_SharedArtifactCache():
+
+    p = [1,2,3,4,'hii']
+    namespace = str(uuid.uuid4())
+    coffee = CountingCoffer()
+    coffee.upload([artifacts.PickleArtifact('test.pickle', p), artifacts.BinaryArtifact('test.bin', b'hohohooh')])
+    first = shared.SharedArtifactCache(coffee, namespace=namespace)
+    second = shared.SharedArtifactCache(coffee, namespace=namespace)
+    assert first.get('test.pickle').data == p
+    assert bytes(second.get_buffer('test.bin')) == b'hohohooh'
+    assert second.get('test.pickle').data == p
+    assert coffee.fetches == 2 # Each artifact is fetched once
+
+    # A process with no access to the data attaches to the published segment.
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=attach_in_subprocess, args=(namespace, 'test.pickle', queue))
+    process.start()
+    assert queue.get(timeout=60) == p
+    process.join()
+
+    name = first.segment_name('test.pickle')
+    first.close()
+    segment = second._attach(name)
+    assert segment is not None
+    segment.close()
+    second.close()
+    assert second._attach(name) is None
+    assert first.get('test.pickle').data == p
+    assert coffee.fetches == 3
+    first.close()